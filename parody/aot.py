@@ -0,0 +1,227 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2021, Paulus Gandung Prakosa <gandung@lists.infradead.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Ahead-of-time compiler from bytecode to importable Python modules.
+"""
+
+import hashlib
+import importlib.util
+import io
+import os
+import py_compile
+import sys
+
+import parody.codegen as codegen
+import parody.exceptions as ex
+import parody.jit as jit
+import parody.jump_label as jump_label
+
+# part of the content hash, bump it whenever the generated code changes
+# so stale modules are not imported.
+AOT_VERSION = 2
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "parody")
+
+MODULE_PREFIX = "parody_aot_"
+
+MODULE_HEADER = '''"""
+Generated by parody.aot from bytecode %s, do not edit.
+"""
+
+import sys
+
+import parody.exceptions as ex
+
+
+def _fail(pc, offset):
+    raise ex.RuntimeError("Division by zero at offset %%d." %% (offset))
+'''
+
+MODULE_RUN = """
+
+def run(out=None):
+    if out is None:
+        out = sys.stdout
+
+    registers = [0] * 4
+    blocks = _create(registers, out.write)
+    pc = 0
+
+    while pc < %d:
+        pc = blocks[pc]()
+
+    return registers
+"""
+
+"""
+Return the bytecode of 'program', either bytecode already or an AST
+root which is run through Codegen.
+"""
+
+
+def get_bytecode(program):
+    if isinstance(program, (bytes, bytearray, memoryview)):
+        return bytes(program)
+
+    return codegen.Codegen(jump_label.JumpLabel()).generate_bytes(program)
+
+
+"""
+Return the content hash the module of 'code' is cached by.
+"""
+
+
+def get_digest(code):
+    digest = hashlib.sha256(b"%d:" % (AOT_VERSION))
+    digest.update(code)
+
+    return digest.hexdigest()[:32]
+
+
+"""
+Return the source of the module running the bytecode 'code': one
+function per basic block, as generated for JitMachine, and a run()
+trampoline. run() writes to 'out' (sys.stdout by default) and returns
+the registers.
+"""
+
+
+def generate_module(code):
+    machine = jit.JitMachine(code, io.StringIO())
+    program = machine.get_program()
+    lines = [
+        MODULE_HEADER % (get_digest(code)),
+        "",
+        "def _create(registers, write):",
+        "    blocks = [None] * %d" % (len(program)),
+    ]
+
+    for pc in range(len(program)):
+        size = machine.get_block_size(pc)
+
+        if size == 0 and machine.get_form(pc) is not None:
+            continue
+
+        lines.append("")
+        lines.append("    def block_%d():" % (pc))
+
+        if size == 0:
+            error = _get_error(machine, pc)
+            lines.append("        raise ex.RuntimeError(%r)" % (error))
+        else:
+            generator = jit.BlockGenerator(machine, pc, pc + size)
+            lines.extend(generator.generate("        "))
+
+        lines.append("")
+        lines.append("    blocks[%d] = block_%d" % (pc, pc))
+
+    lines.append("")
+    lines.append("    return blocks")
+
+    return "\n".join(lines) + "\n" + MODULE_RUN % (len(program))
+
+
+"""
+Write the module of 'program' to 'cache_dir' (CACHE_DIR by default),
+unless it is there already, compile it to a .pyc and return its path.
+"""
+
+
+def compile_module(program, cache_dir=None):
+    code = get_bytecode(program)
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    path = os.path.join(cache_dir, MODULE_PREFIX + get_digest(code) + ".py")
+
+    if os.path.exists(path) == False:
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # written aside and renamed, so a concurrent import never sees
+        # a partial module.
+        temporary = "%s.%d.tmp" % (path, os.getpid())
+
+        with open(temporary, "w") as f:
+            f.write(generate_module(code))
+
+        os.replace(temporary, path)
+
+    if os.path.exists(importlib.util.cache_from_source(path)) == False:
+        py_compile.compile(path, doraise=True)
+
+    return path
+
+
+"""
+Import and return the module of 'program', compiling it first when it
+is not cached yet.
+"""
+
+
+def load_module(program, cache_dir=None):
+    code = get_bytecode(program)
+    name = MODULE_PREFIX + get_digest(code)
+
+    if name in sys.modules:
+        return sys.modules[name]
+
+    path = compile_module(code, cache_dir)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[name] = module
+
+    return module
+
+
+"""
+Run 'program' through its cached module, writing to 'out'.
+"""
+
+
+def run(program, out=None, cache_dir=None):
+    return load_module(program, cache_dir).run(out)
+
+
+"""
+Return the message of the error the instruction at 'pc' always raises.
+"""
+
+
+def _get_error(machine, pc):
+    handler, operand = machine.get_program()[pc]
+
+    try:
+        handler(pc, operand)
+    except ex.RuntimeError as e:
+        return str(e)
+
+    raise ex.RuntimeError(
+        "Instruction at offset %d does not fail." % (machine.offsets[pc])
+    )
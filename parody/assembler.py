@@ -0,0 +1,161 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2021, Paulus Gandung Prakosa <gandung@lists.infradead.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Fused one-pass assembler, source bytes straight to bytecode.
+"""
+
+import parody.exceptions as ex
+import parody.jump_label as jump_label
+import parody.lexer as lexer
+import parody.node_kind as n
+import parody.opcodes.encoding as enc
+import parody.opcodes.general as gen
+import parody.opcodes.jump as jgen
+import parody.parser as parser
+
+"""
+Assemble 'buffer' into bytecode, returning the same bytes as running
+it through Lexer, Parser and Codegen.
+"""
+
+
+def assemble(buffer):
+    return Assembler().assemble(buffer)
+
+
+class Assembler(lexer.Lexer):
+    """
+    Lexer which validates and encodes every instruction line as soon
+    as its tokens are scanned, without building token objects or an
+    AST. Errors are raised in source order, so when a program holds
+    several errors the reported one may differ from the pipeline.
+    """
+
+    def __init__(self):
+        super(Assembler, self).__init__()
+        self.line = 0
+        self.kinds = []
+        self.values = []
+        self.jump_label = jump_label.JumpLabel()
+        self.patch_jump = []
+        self.generated = bytearray()
+
+    """
+	"""
+
+    def assemble(self, buffer):
+        self.lex(buffer)
+
+        if len(self.kinds) != 0:
+            self._process_instruction_line()
+
+        for position, name in self.patch_jump:
+            off = self.jump_label.fetch(name)
+
+            if off is None:
+                raise ex.AstError("Jump label '%s' is not defined." % (name))
+
+            enc.JUMP.pack_into(
+                self.generated,
+                position,
+                gen.JUMP_REX_PREFIX,
+                jgen.JUMP_PLAIN,
+                off & 0xFFFFFFFF,
+            )
+
+        return bytes(self.generated)
+
+    """
+	"""
+
+    def get_jump_label(self):
+        return self.jump_label
+
+    """
+	"""
+
+    def _emit(self, kind, value, position):
+        # tokens are consumed right away, as if flushed by a stream.
+        self.flushed += 1
+
+        if len(self.kinds) != 0:
+            if kind != n.NEWLINE:
+                self.kinds.append(kind)
+                self.values.append(value)
+                return
+
+            self.line += 1
+            self._process_instruction_line()
+            return
+
+        if kind == n.LABEL:
+            self.jump_label.add(value, len(self.generated) - 1)
+
+        if kind == n.MNEMONIC:
+            self.kinds.append(kind)
+            self.values.append(value)
+
+    """
+	"""
+
+    def _process_instruction_line(self):
+        kinds = self.kinds
+        values = self.values
+        signature = tuple(kinds[1:])
+
+        parser.validate_instruction(values[0], signature, self.line)
+
+        if signature == (n.REGISTER, n.COMMA, n.REGISTER):
+            self.generated.append(
+                enc.regs_to_regs(
+                    values[0], enc.REGISTERS[values[1]], enc.REGISTERS[values[3]]
+                )
+            )
+        elif signature == (n.NUMBER, n.COMMA, n.REGISTER):
+            self.generated.append(enc.imm8_to_regs(values[0], enc.REGISTERS[values[3]]))
+            self._process_number(values[1])
+        elif signature == (n.REGISTER,):
+            self.generated.append(enc.prib(enc.REGISTERS[values[1]]))
+        elif signature == (n.NUMBER,):
+            self.generated.append(gen.PRIB_IMM8)
+            self._process_number(values[1])
+        else:
+            self.patch_jump.append((len(self.generated), values[1]))
+            self.generated += bytes(enc.JUMP.size)
+
+        del kinds[:]
+        del values[:]
+
+    """
+	"""
+
+    def _process_number(self, num):
+        self.generated += enc.immediate(num)
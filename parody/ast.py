@@ -33,9 +33,29 @@ AST objects, methods, and related-operations.
 """
 
 import parody.ast_kind as a
+import parody.node_kind as n
+
+TYPE_NAMES = {
+    a.AST_ROOT: "<root>",
+    a.AST_MNEMONIC: "<mnemonic>",
+    a.AST_REGISTER: "<register>",
+    a.AST_INTEGER_VALUE: "<integer>",
+    a.AST_INSTRUCTION_LINE: "<instruction-line>",
+    a.AST_LABEL: "<label>",
+}
+
+# AST type of the node made out of an instruction line token.
+NODE_TYPES = {
+    n.MNEMONIC: a.AST_MNEMONIC,
+    n.REGISTER: a.AST_REGISTER,
+    n.NUMBER: a.AST_INTEGER_VALUE,
+    n.LABEL: a.AST_LABEL,
+}
 
 
 class Ast(object):
+    __slots__ = ("value", "type", "childs")
+
     def __init__(self, ast_type, value):
         self.value = value
         self.type = ast_type
@@ -96,18 +116,7 @@ class Ast(object):
     """
 
     def _type_to_string_resolver(self, ast_type):
-        if ast_type == a.AST_ROOT:
-            return "<root>"
-        elif ast_type == a.AST_MNEMONIC:
-            return "<mnemonic>"
-        elif ast_type == a.AST_REGISTER:
-            return "<register>"
-        elif ast_type == a.AST_INTEGER_VALUE:
-            return "<integer>"
-        elif ast_type == a.AST_INSTRUCTION_LINE:
-            return "<instruction-line>"
-        elif ast_type == a.AST_LABEL:
-            return "<label>"
+        return TYPE_NAMES.get(ast_type)
 
     """
     """
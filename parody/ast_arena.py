@@ -0,0 +1,371 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2021, Paulus Gandung Prakosa <gandung@lists.infradead.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Arena-backed AST representation.
+"""
+
+from array import array
+
+import parody.ast as ast
+import parody.ast_kind as a
+import parody.node_kind as n
+
+
+class AstArena(object):
+    """
+    A whole tree stored as parallel columns, in pre-order: node type,
+    interned value id, child count and subtree size. Index 0 is the
+    root, the first child of a node directly follows it, and the next
+    sibling of a node follows its subtree.
+
+    The arena only grows by appending children to the root, which is
+    the only way Parser builds a tree. Values are interned by token
+    kind and value, so every distinct operand is only referenced once.
+    """
+
+    def __init__(self):
+        self.types = array("B", [a.AST_ROOT])
+        self.values = array("L", [0])
+        self.counts = array("L", [0])
+        self.sizes = array("L", [0])
+        self.symbols = [None]
+        self.symbol_ids = {}
+
+    """
+	"""
+
+    def __len__(self):
+        return len(self.types)
+
+    """
+    Root accessors, so an arena can stand in for an Ast root.
+    """
+
+    def get_type(self):
+        return a.AST_ROOT
+
+    """
+	"""
+
+    def get_value(self):
+        return None
+
+    """
+	"""
+
+    def get_childs(self):
+        return [AstCursor(self, index) for index in self.iter_childs(0)]
+
+    """
+	"""
+
+    def get_child_at(self, index):
+        return AstCursor(self, 0).get_child_at(index)
+
+    """
+	"""
+
+    def get_cursor(self, index=0):
+        return AstCursor(self, index)
+
+    """
+    Copy 'child', an Ast or a cursor of any arena, under the root.
+    """
+
+    def add_child(self, child):
+        self.counts[0] += 1
+        stack = [(child, 1)]
+        path = [0]
+
+        while len(stack) != 0:
+            node, depth = stack.pop()
+            childs = node.get_childs()
+
+            del path[depth:]
+
+            for index in path:
+                self.sizes[index] += 1
+
+            path.append(self._append(node.get_type(), node.get_value(), len(childs)))
+
+            for el in reversed(childs):
+                stack.append((el, depth + 1))
+
+    """
+	"""
+
+    def add_label(self, token):
+        self._append(a.AST_LABEL, token, 0)
+        self.counts[0] += 1
+        self.sizes[0] += 1
+
+    """
+    Append an instruction line made of 'tokens', a mnemonic followed
+    by its operands (commas are skipped).
+    """
+
+    def add_instruction_line(self, tokens):
+        line = self._append(a.AST_INSTRUCTION_LINE, None, 0)
+
+        for el in tokens:
+            if el.get_type() == n.COMMA:
+                continue
+
+            self._append(ast.NODE_TYPES[el.get_type()], el, 0)
+
+        size = len(self.types) - line - 1
+
+        self.counts[line] = size
+        self.sizes[line] = size
+        self.counts[0] += 1
+        self.sizes[0] += size + 1
+
+    """
+    Return the nodes below the root as flat columns, cheap to pickle:
+    (root child count, types, values, child counts, subtree sizes,
+    symbols).
+    """
+
+    def get_columns(self):
+        return (
+            self.counts[0],
+            self.types[1:],
+            self.values[1:],
+            self.counts[1:],
+            self.sizes[1:],
+            self.symbols,
+        )
+
+    """
+    Append the nodes of 'columns' (see get_columns()) under the root in
+    bulk, only the value ids are translated to this arena's symbols.
+    """
+
+    def add_columns(self, columns):
+        count, types, values, counts, sizes, symbols = columns
+        ids = [0] + [self._intern(symbol) for symbol in symbols[1:]]
+
+        self.types.extend(types)
+        self.values.extend(array("L", map(ids.__getitem__, values)))
+        self.counts.extend(counts)
+        self.sizes.extend(sizes)
+        self.counts[0] += count
+        self.sizes[0] += len(types)
+
+    """
+    Index based accessors, these do not allocate anything.
+    """
+
+    def get_node_type(self, index):
+        return self.types[index]
+
+    """
+	"""
+
+    def get_node_value(self, index):
+        return self.symbols[self.values[index]]
+
+    """
+	"""
+
+    def get_child_count(self, index):
+        return self.counts[index]
+
+    """
+	"""
+
+    def iter_childs(self, index):
+        child = index + 1
+
+        for _ in range(self.counts[index]):
+            yield child
+            child += self.sizes[child] + 1
+
+    """
+    Yield (index, depth) for every node below 'index', in pre-order.
+    """
+
+    def walk(self, index=0):
+        stop = index + self.sizes[index] + 1
+        ends = []
+
+        for current in range(index, stop):
+            while len(ends) != 0 and ends[-1] <= current:
+                ends.pop()
+
+            yield current, len(ends)
+
+            ends.append(current + self.sizes[current] + 1)
+
+    """
+	"""
+
+    def _append(self, ast_type, value, count):
+        self.types.append(ast_type)
+        self.values.append(self._intern(value))
+        self.counts.append(count)
+        self.sizes.append(0)
+
+        return len(self.types) - 1
+
+    """
+	"""
+
+    def _intern(self, value):
+        if value is None:
+            return 0
+
+        key = (value.get_type(), value.get_value())
+        symbol = self.symbol_ids.get(key)
+
+        if symbol is None:
+            symbol = len(self.symbols)
+            self.symbol_ids[key] = symbol
+            self.symbols.append(value)
+
+        return symbol
+
+    """
+    """
+
+    def __repr__(self):
+        return repr(self.get_cursor(0))
+
+
+class AstCursor(object):
+    """
+    A lightweight view of one arena node, with the read-only interface
+    of Ast, so Codegen and the other tree walkers can use either one.
+    """
+
+    __slots__ = ("arena", "index")
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+
+    """
+	"""
+
+    def get_arena(self):
+        return self.arena
+
+    """
+	"""
+
+    def get_index(self):
+        return self.index
+
+    """
+	"""
+
+    def get_type(self):
+        return self.arena.types[self.index]
+
+    """
+	"""
+
+    def get_value(self):
+        return self.arena.symbols[self.arena.values[self.index]]
+
+    """
+	"""
+
+    def get_child_at(self, index):
+        count = self.arena.counts[self.index]
+
+        if index < 0:
+            index += count
+
+        if index < 0 or index >= count:
+            return None
+
+        for position, child in enumerate(self.arena.iter_childs(self.index)):
+            if position == index:
+                return AstCursor(self.arena, child)
+
+    """
+	"""
+
+    def get_childs(self):
+        return [
+            AstCursor(self.arena, child) for child in self.arena.iter_childs(self.index)
+        ]
+
+    """
+    """
+
+    def __repr__(self):
+        return "%s (%s)" % (
+            ast.TYPE_NAMES.get(self.get_type()),
+            "<nil>" if self.get_value() == None else self.get_value(),
+        )
+
+
+"""
+Build the Ast nodes of 'columns' (see AstArena.get_columns()) and return
+the ones directly below the root.
+"""
+
+
+def build_childs(columns):
+    count, types, values, counts, sizes, symbols = columns
+    nodes = list(map(ast.Ast, types, map(symbols.__getitem__, values)))
+    childs = []
+    index = 0
+
+    while index < len(nodes):
+        childs.append(nodes[index])
+        _link_childs(nodes, counts, sizes, index)
+        index += sizes[index] + 1
+
+    return childs
+
+
+"""
+Attach the nodes of the subtree at 'index' to their parents.
+"""
+
+
+def _link_childs(nodes, counts, sizes, index):
+    size = sizes[index]
+
+    # the usual case, a node whose children are all leaves.
+    if size == counts[index]:
+        nodes[index].set_childs(nodes[index + 1 : index + size + 1])
+        return
+
+    child = index + 1
+
+    for _ in range(counts[index]):
+        nodes[index].add_child(nodes[child])
+        _link_childs(nodes, counts, sizes, child)
+        child += sizes[child] + 1
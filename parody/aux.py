@@ -32,14 +32,166 @@
 Auxiliary helper.
 """
 
-from pprint import pprint
+import json
+import sys
+
+from itertools import islice
+
+import parody.ast as ast
+import parody.ast_kind as a
+
+FORMAT_TREE = "tree"
+FORMAT_COMPACT = "compact"
+FORMAT_JSON = "json"
+
+# characters held back before they are handed to the output stream.
+DUMP_BUFFER_SIZE = 1 << 16
 
 """
 """
 
 
 def ast_traverser(ast):
-    pprint(ast)
+    dump_ast(ast, sys.stdout, indent="")
+
+
+"""
+Write 'tree' (an Ast, or an AstArena) to the text stream 'out'.
+
+FORMAT_TREE writes one node per line, indented by depth, FORMAT_COMPACT
+writes one source-like line per label or instruction line, and
+FORMAT_JSON writes one JSON object per label or instruction line. Only
+the root childs in [start, stop) are written, and FORMAT_TREE and
+FORMAT_JSON skip the nodes deeper than 'max_depth' (the root is at
+depth 0).
+"""
+
+
+def dump_ast(
+    tree,
+    out=None,
+    format=FORMAT_TREE,
+    start=0,
+    stop=None,
+    max_depth=None,
+    indent="  ",
+    buffer_size=DUMP_BUFFER_SIZE,
+):
+    if out is None:
+        out = sys.stdout
+
+    if format == FORMAT_TREE:
+        render = lambda child: _render_tree(child, max_depth, indent)
+    elif format == FORMAT_COMPACT:
+        render = _render_compact
+    elif format == FORMAT_JSON:
+        render = lambda child: _render_json(child, max_depth)
+    else:
+        raise ValueError("Unknown dump format '%s'." % (format))
+
+    pending = []
+    size = 0
+
+    if format == FORMAT_TREE and start == 0:
+        pending.append("%r\n" % (tree))
+
+    if max_depth is not None and max_depth < 1:
+        stop = start
+
+    for child in islice(tree.get_childs(), start, stop):
+        text = render(child)
+        pending.append(text)
+        size += len(text)
+
+        if size >= buffer_size:
+            out.write("".join(pending))
+            pending = []
+            size = 0
+
+    out.write("".join(pending))
+
+
+"""
+"""
+
+
+def _render_tree(child, max_depth, indent):
+    lines = []
+    stack = [(child, 1)]
+
+    while len(stack) != 0:
+        node, depth = stack.pop()
+        lines.append("%s%r\n" % (indent * depth, node))
+
+        if max_depth is not None and depth >= max_depth:
+            continue
+
+        for el in reversed(node.get_childs()):
+            stack.append((el, depth + 1))
+
+    return "".join(lines)
+
+
+"""
+"""
+
+
+def _render_compact(child):
+    if child.get_type() == a.AST_LABEL:
+        return "@%s:\n" % (child.get_value().get_value())
+
+    childs = child.get_childs()
+    operands = ", ".join([_render_operand(el) for el in childs[1:]])
+
+    return "%s %s\n" % (childs[0].get_value().get_value(), operands)
+
+
+"""
+"""
+
+
+def _render_operand(node):
+    value = node.get_value().get_value()
+
+    if node.get_type() == a.AST_INTEGER_VALUE:
+        return "#%d" % (value)
+
+    if node.get_type() == a.AST_LABEL:
+        return "@%s" % (value)
+
+    return value
+
+
+"""
+"""
+
+
+def _render_json(child, max_depth):
+    record = _json_node(child)
+    stack = [(child, record, 1)]
+
+    while len(stack) != 0:
+        node, parent, depth = stack.pop()
+
+        if max_depth is not None and depth >= max_depth:
+            continue
+
+        for el in node.get_childs():
+            entry = _json_node(el)
+            parent.setdefault("childs", []).append(entry)
+            stack.append((el, entry, depth + 1))
+
+    return json.dumps(record) + "\n"
+
+
+"""
+"""
+
+
+def _json_node(node):
+    value = node.get_value()
 
-    for child in ast.get_childs():
-        ast_traverser(child)
+    return {
+        "type": ast.TYPE_NAMES.get(node.get_type()).strip("<>"),
+        "value": None if value is None else value.get_value(),
+    }
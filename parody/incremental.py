@@ -0,0 +1,336 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2021, Paulus Gandung Prakosa <gandung@lists.infradead.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Incremental front end, re-lexing and re-parsing only edited lines.
+"""
+
+from itertools import chain, islice
+
+import parody.ast as ast
+import parody.ast_kind as a
+import parody.lexer as lexer
+import parody.parser as parser
+
+# placeholder of the lines which are not parsed yet, or which failed
+# to parse behind a word that swallowed the rest of the source.
+PARKED = ([], [], 0, False)
+
+# cached lines kept beyond the live ones before edit() drops the stale
+# entries, so the cache stays proportional to the source.
+CACHE_SLACK = 1024
+
+
+class IncrementalParser(object):
+    """
+    Keeps the tokens and tree nodes of every source line in a cache
+    keyed by the line content, so that after an edit only the lines
+    not seen before are lexed and parsed again.
+
+    Identical lines share their cached nodes, hence the tree returned
+    by get_ast() must be treated as read-only.
+    """
+
+    def __init__(self, lexer_type=lexer.Lexer, parser_type=parser.Parser):
+        self.lexer_type = lexer_type
+        self.parser_type = parser_type
+        self.ast = ast.Ast(a.AST_ROOT, None)
+        self.line = 0
+        self.lines = [b""]
+        self.keys = [None]
+        self.entries = [PARKED]
+        self.counts = [0]
+        self.sizes = [0]
+        self.exhausted = 0
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    """
+    Parse a whole new version of the source.
+    """
+
+    def parse(self, buffer):
+        self._update(0, len(self.lines), bytes(buffer).split(b"\n"))
+        self._prune_cache()
+
+    """
+    Replace source lines 'start' up to (but excluding) 'stop', counted
+    from zero, with the lines of 'buffer'. A trailing newline in
+    'buffer' terminates its last line, an empty buffer deletes lines.
+    """
+
+    def edit(self, start, stop, buffer):
+        lines = bytes(buffer).split(b"\n")
+
+        if lines[-1] == b"":
+            lines.pop()
+
+        self._update(start, stop, lines)
+
+        if len(self.cache) > 2 * len(self.lines) + CACHE_SLACK:
+            self._prune_cache()
+
+    """
+	"""
+
+    def get_ast(self):
+        return self.ast
+
+    """
+	"""
+
+    def get_line(self):
+        return self.line
+
+    """
+	"""
+
+    def get_source(self):
+        return b"\n".join(self.lines)
+
+    """
+	"""
+
+    def get_token_objects(self):
+        return list(chain.from_iterable(entry[0] for entry in self._live_entries()))
+
+    """
+	"""
+
+    def _update(self, start, stop, new):
+        # an empty source still holds one empty line.
+        if len(self.lines) - (stop - start) + len(new) == 0:
+            new = [b""]
+
+        count = len(new)
+        lines = self.lines[:start] + new + self.lines[stop:]
+        keys = self.keys[:start] + [None] * count + self.keys[stop:]
+        entries = self.entries[:start] + [None] * count + self.entries[stop:]
+        counts = self.counts[:start] + [None] * count + self.counts[stop:]
+        total = len(lines)
+
+        # besides the edited lines, the lines which are or were the
+        # first and the last ones may have changed their position
+        # dependent lexing rules.
+        indexes = set(range(start, start + count))
+        indexes.update(index for index in (0, total - 2, total - 1) if index >= 0)
+
+        for index in (0, len(self.lines) - 2, len(self.lines) - 1):
+            if 0 <= index < start:
+                indexes.add(index)
+            elif index >= stop:
+                indexes.add(index - stop + start + count)
+
+        # lines parked behind a word which swallowed the rest of the
+        # source have never been parsed.
+        if self.exhausted != 0:
+            indexes.update(index for index, key in enumerate(keys) if key is None)
+
+        indexes = sorted(indexes)
+
+        # the whole source is checked before lexing starts.
+        for index in indexes:
+            if lexer.NON_ASCII.search(lines[index]) is not None:
+                lexer.check_ascii(
+                    lines[index], sum(len(line) + 1 for line in lines[:index]), index
+                )
+
+        low = start
+        high = start + count
+        failures = []
+        cursor = 0
+        line = 0
+
+        for index in indexes:
+            key = self._key(lines, index)
+
+            if key is not None and key == keys[index]:
+                continue
+
+            entry = self.cache.get(key)
+
+            low = min(low, index)
+            high = max(high, index + 1)
+
+            if entry is None:
+                self.misses += 1
+                line += sum(counts[cursor:index])
+                cursor = index
+                instance = self.parser_type(self.lexer_type())
+                instance.line = line
+
+                try:
+                    entry = self._parse_line(instance, key)
+                except Exception as e:
+                    lexing = instance.get_input() is None
+                    exhausted = instance.get_lexer().exhausted
+                    failures.append((index, lexing, exhausted, e))
+                    keys[index] = None
+                    entries[index] = PARKED
+                    counts[index] = 0
+                    continue
+
+                self.cache[key] = entry
+            else:
+                self.hits += 1
+
+            keys[index] = key
+            entries[index] = entry
+            counts[index] = entry[2]
+
+        if len(failures) != 0:
+            self._raise_failure(entries, failures)
+
+        # the same region, in the line numbering before the edit.
+        old_high = high - count + (stop - start)
+        old = self.entries[low:old_high]
+        replaced = entries[low:high]
+        exhausted = (
+            self.exhausted
+            - sum(1 for entry in old if entry[3] == True)
+            + sum(1 for entry in replaced if entry[3] == True)
+        )
+
+        sizes = self.sizes[:low] + [len(entry[1]) for entry in replaced]
+        sizes += self.sizes[old_high:]
+        rebuild = self.exhausted != 0 or exhausted != 0
+
+        if rebuild == False:
+            offset = sum(islice(sizes, 0, low))
+            self.ast.get_childs()[offset : offset + sum(self.sizes[low:old_high])] = [
+                child for entry in replaced for child in entry[1]
+            ]
+            self.line += sum(counts[low:high]) - sum(self.counts[low:old_high])
+
+        self.lines = lines
+        self.keys = keys
+        self.entries = entries
+        self.counts = counts
+        self.sizes = sizes
+        self.exhausted = exhausted
+
+        if rebuild == True:
+            live = self._live_entries()
+            self.ast.set_childs([child for entry in live for child in entry[1]])
+            self.line = sum(entry[2] for entry in live)
+
+    """
+	"""
+
+    def _key(self, lines, index):
+        last = len(lines) - 1
+
+        # how the line ends: a newline followed by more input, a
+        # newline which is the last byte of the source, or nothing.
+        if index < last - 1 or (index == last - 1 and lines[last] != b""):
+            tail = b"\n\n"
+        elif index == last - 1:
+            tail = b"\n"
+        else:
+            tail = b""
+
+        return (lines[index], index > 0, tail)
+
+    """
+	"""
+
+    def _parse_line(self, instance, key):
+        content, follows, tail = key
+        line = instance.line
+
+        # a leading newline stands for the tokens of the preceding
+        # lines, and the extra byte after a newline which does not end
+        # the source makes the lexer scan that newline.
+        buffer = (b"\n" if follows == True else b"") + content + tail
+        instance.parse(buffer)
+
+        tokens = list(instance.get_input())
+
+        if follows == True and len(buffer) > 1:
+            del tokens[0]
+
+        return (
+            tokens,
+            instance.get_ast().get_childs(),
+            instance.line - line,
+            instance.get_lexer().exhausted,
+        )
+
+    """
+    Raise the error a whole source parse would have raised: the whole
+    source is lexed before it is parsed, and nothing is seen after a
+    word which swallowed the rest of the source, even one on a line
+    which failed to parse.
+    """
+
+    def _raise_failure(self, entries, failures):
+        last = len(entries)
+
+        for index, entry in enumerate(entries):
+            if entry[3] == True:
+                last = index
+                break
+
+        for index, lexing, exhausted, error in failures:
+            if exhausted == True:
+                last = min(last, index)
+
+        failures = [failure for failure in failures if failure[0] <= last]
+
+        for index, lexing, exhausted, error in failures:
+            if lexing == True:
+                raise error
+
+        for index, lexing, exhausted, error in failures:
+            raise error
+
+    """
+    Drop the cached lines which are gone from the source.
+    """
+
+    def _prune_cache(self):
+        self.cache = dict(
+            (key, entry)
+            for key, entry in zip(self.keys, self.entries)
+            if key is not None
+        )
+
+    """
+	"""
+
+    def _live_entries(self):
+        if self.exhausted == 0:
+            return self.entries
+
+        # an unterminated word swallows every line that follows it.
+        for index, entry in enumerate(self.entries):
+            if entry[3] == True:
+                return self.entries[: index + 1]
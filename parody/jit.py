@@ -0,0 +1,414 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2021, Paulus Gandung Prakosa <gandung@lists.infradead.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Basic-block compiler from pre-decoded bytecode to Python functions.
+"""
+
+import sys
+import time
+
+import parody.exceptions as ex
+import parody.vm as vm
+
+# longest block compiled into a single function, in instructions.
+BLOCK_MAX = 256
+
+# prib values written by a single call.
+PRINT_BATCH = 32
+
+# compiled blocks kept by source, the cache is emptied once full.
+CODE_CACHE_SIZE = 4096
+
+# runs of a block on the threaded handlers before TieredMachine compiles
+# it.
+PROMOTION_THRESHOLD = 16
+
+# expression of the new value of the destination register.
+EXPRESSIONS = {
+    "movb": "{value}",
+    "addb": "({dst} + {value}) & 0xFF",
+    "subb": "({dst} - {value}) & 0xFF",
+    "mulb": "({dst} * {value}) & 0xFF",
+    "divb": "{dst} // {value}",
+}
+
+_code_cache = {}
+
+
+class BlockGenerator(object):
+    """
+    Generates the straight-line Python source of the block made of the
+    instructions 'start' to 'stop' (excluded) of a ThreadedMachine.
+    Registers are local variables named r0 to r3, loaded on entry and
+    stored back on exit, and prib values are written PRINT_BATCH at a
+    time. The body returns the index of the next instruction, and only
+    uses the names 'registers', 'write' and '_fail', which is called
+    with the index and offset of a division by zero once the registers
+    and queued prints are flushed, and must raise.
+    """
+
+    def __init__(self, machine, start, stop):
+        self.machine = machine
+        self.start = start
+        self.stop = stop
+        self.lines = []
+        self.written = set()
+        self.formats = []
+        self.values = []
+        self.temporaries = 0
+        self.indent = "    "
+
+    """
+	"""
+
+    def generate(self, indent="    "):
+        self.indent = indent
+        program = self.machine.get_program()
+        offsets = self.machine.offsets
+        used = set()
+        next_pc = self.stop
+
+        for pc in range(self.start, self.stop):
+            name, fields = self.machine.get_form(pc)
+            fields = dict(fields)
+            operand = program[pc][1]
+
+            if name == "jump":
+                next_pc = operand
+                break
+
+            if name == "prib_imm8":
+                self._add_print("%d\n" % (operand), None)
+                continue
+
+            if name == "prib_reg":
+                used.add(fields["reg"])
+                self._add_print("%d\n", "r%d" % (fields["reg"]))
+                continue
+
+            mnemonic, form = name.split("_")
+            dst = "r%d" % (fields["dst"])
+            used.add(fields["dst"])
+
+            if form == "regs":
+                used.add(fields["src"])
+                value = "r%d" % (fields["src"])
+            else:
+                value = str(operand)
+
+            if mnemonic == "divb" and value == "0":
+                self._flush(indent)
+                self.lines.append("%s_fail(%d, %d)" % (indent, pc, offsets[pc]))
+                return self._wrap(used, indent)
+
+            if mnemonic == "divb" and form == "regs":
+                self.lines.append("%sif %s == 0:" % (indent, value))
+                self._flush(indent * 2, keep=True)
+                self.lines.append("%s_fail(%d, %d)" % (indent * 2, pc, offsets[pc]))
+
+            expression = EXPRESSIONS[mnemonic].format(dst=dst, value=value)
+
+            self._save_printed(dst, indent)
+            self.lines.append("%s%s = %s" % (indent, dst, expression))
+            self.written.add(dst)
+
+        self._flush(indent)
+        self.lines.append("%sreturn %d" % (indent, next_pc))
+
+        return self._wrap(used, indent)
+
+    """
+    Prepend the register loads to the body lines and return them.
+    """
+
+    def _wrap(self, used, indent):
+        loads = ["%sr%d = registers[%d]" % (indent, reg, reg) for reg in sorted(used)]
+
+        return loads + self.lines
+
+    """
+    Queue a prib of the literal 'format', or of 'value' if it is not
+    None, writing the batch once full.
+    """
+
+    def _add_print(self, format, value):
+        self.formats.append(format)
+
+        if value is not None:
+            self.values.append(value)
+
+        if len(self.formats) >= PRINT_BATCH:
+            self._write_prints(self.indent)
+            self.formats = []
+            self.values = []
+
+    """
+    Copy the register 'dst' to a temporary when queued prints still
+    refer to it, since it is about to change.
+    """
+
+    def _save_printed(self, dst, indent):
+        if dst not in self.values:
+            return
+
+        temporary = "p%d" % (self.temporaries)
+        self.temporaries += 1
+        self.lines.append("%s%s = %s" % (indent, temporary, dst))
+        self.values = [temporary if v == dst else v for v in self.values]
+
+    """
+    Store the written registers back and write the queued prints; the
+    queue is kept for the code following a 'keep' flush.
+    """
+
+    def _flush(self, indent, keep=False):
+        for dst in sorted(self.written):
+            self.lines.append("%sregisters[%s] = %s" % (indent, dst[1:], dst))
+
+        if len(self.formats) > 0:
+            self._write_prints(indent)
+
+        if keep == False:
+            self.formats = []
+            self.values = []
+
+    """
+	"""
+
+    def _write_prints(self, indent):
+        text = "".join(self.formats)
+
+        if len(self.values) == 0:
+            self.lines.append("%swrite(%r)" % (indent, text))
+        else:
+            self.lines.append(
+                "%swrite(%r %% (%s,))" % (indent, text, ", ".join(self.values))
+            )
+
+
+class JitMachine(vm.ThreadedMachine):
+    """
+    Splits the pre-decoded program into basic blocks, at jump targets and
+    after jumps, and compiles each block to a Python function once it is
+    entered for the 'threshold'-th time, the previous runs being
+    interpreted on the threaded handlers. Blocks chain through a
+    trampoline calling the function of the current block, which returns
+    the index of the next one.
+
+    Instructions that always fail, and the ones run while fewer steps
+    than a whole block are left, run on the threaded handlers. When a
+    block raises, the steps and the instruction pointer account for
+    the instructions it completed, as they do in the byte-level machine.
+    """
+
+    def __init__(self, code, out=None, threshold=1):
+        super(JitMachine, self).__init__(code, out, superinstructions=False)
+        self.threshold = threshold
+        self.sizes = [0] * len(self.program)
+        self.blocks = [None] * len(self.program)
+        self.counters = [0] * len(self.program)
+        self.failed = None
+        self.compiled = 0
+        self.cache_hits = 0
+        self.compile_elapsed = 0.0
+        self._find_blocks()
+
+    """
+	"""
+
+    def get_stats(self):
+        stats = super(JitMachine, self).get_stats()
+        stats["blocks"] = len(self.sizes) - self.sizes.count(0)
+        stats["promoted"] = self.compiled
+        stats["cache_hits"] = self.cache_hits
+        stats["compile_seconds"] = self.compile_elapsed
+
+        return stats
+
+    """
+    Return the instruction count of the block starting at 'pc', or 0
+    when no block starts there.
+    """
+
+    def get_block_size(self, pc):
+        return self.sizes[pc]
+
+    """
+    Return how many times the block starting at 'pc' was entered before
+    being compiled.
+    """
+
+    def get_block_counter(self, pc):
+        return self.counters[pc]
+
+    """
+	"""
+
+    def run(self, max_steps=None):
+        calls = self.calls
+        sizes = self.sizes
+        blocks = self.blocks
+        counters = self.counters
+        threshold = self.threshold
+        end = len(self.program)
+        pc = self.pc
+        steps = 0
+        limit = sys.maxsize if max_steps is None else max_steps
+        started = time.perf_counter()
+
+        try:
+            while pc < end:
+                size = sizes[pc]
+
+                if size == 0 or steps + size > limit:
+                    if steps == limit:
+                        break
+
+                    pc = calls[pc]()
+                    steps += 1
+                    continue
+
+                block = blocks[pc]
+
+                if block is None:
+                    counters[pc] += 1
+
+                    if counters[pc] < threshold:
+                        for _ in range(size):
+                            pc = calls[pc]()
+                            steps += 1
+
+                        continue
+
+                    block = self.compile_block(pc)
+
+                pc = block()
+                steps += size
+        except ex.RuntimeError:
+            if self.failed is not None:
+                steps += self.failed - pc
+                pc = self.failed
+                self.failed = None
+
+            raise
+        finally:
+            self.elapsed += time.perf_counter() - started
+            self.steps += steps
+            self.pc = pc
+
+        return pc >= end
+
+    """
+    Compile the block starting at 'pc', reusing the code object of a
+    block with the same source, and return its function.
+    """
+
+    def compile_block(self, pc):
+        started = time.perf_counter()
+        body = BlockGenerator(self, pc, pc + self.sizes[pc]).generate("        ")
+        source = "\n".join(
+            ["def create(registers, write, _fail):", "    def block():"]
+            + body
+            + ["    return block", ""]
+        )
+        code = _code_cache.get(source)
+
+        if code is None:
+            if len(_code_cache) >= CODE_CACHE_SIZE:
+                _code_cache.clear()
+
+            code = compile(source, "<block %d>" % (self.offsets[pc]), "exec")
+            _code_cache[source] = code
+        else:
+            self.cache_hits += 1
+
+        namespace = {}
+        exec(code, namespace)
+
+        block = namespace["create"](self.registers, self.out.write, self._fail)
+        self.blocks[pc] = block
+        self.compiled += 1
+        self.compile_elapsed += time.perf_counter() - started
+
+        return block
+
+    """
+    Called by a compiled block on a division by zero at the instruction
+    'pc', found at 'offset'.
+    """
+
+    def _fail(self, pc, offset):
+        self.failed = pc
+        vm._divb(0, 0, offset)
+
+    """
+    Set the size of every block: a block starts after an instruction
+    that always fails, at a jump target or where the previous one ends,
+    and ends after a jump or BLOCK_MAX instructions.
+    """
+
+    def _find_blocks(self):
+        program = self.program
+        end = len(program)
+        targets = set(
+            [operand for handler, operand in program if handler == self._thread_jump]
+        )
+        pc = 0
+
+        while pc < end:
+            if self.get_form(pc) is None:
+                pc += 1
+                continue
+
+            start = pc
+
+            while True:
+                form = self.get_form(pc)
+                pc += 1
+
+                if form[0] == "jump" or pc >= end or pc - start >= BLOCK_MAX:
+                    break
+
+                if pc in targets or self.get_form(pc) is None:
+                    break
+
+            self.sizes[start] = pc - start
+
+
+class TieredMachine(JitMachine):
+    """
+    JitMachine interpreting every block until it was entered
+    PROMOTION_THRESHOLD times, so short programs and code run a few
+    times do not pay for its compilation.
+    """
+
+    def __init__(self, code, out=None, threshold=PROMOTION_THRESHOLD):
+        super(TieredMachine, self).__init__(code, out, threshold)
@@ -32,268 +32,373 @@
 Lexing class, objects, and properties.
 """
 
+import re
+
 import parody.token_kind as t
 import parody.node_kind as n
 import parody.node as node
+import parody.token_stream as ts
 
 from parody.exceptions import SyntaxError as ParodySyntaxError
 from parody.exceptions import LexedEntityError
 
+# character classes, every input byte is mapped to one of these
+# through the scanner table below.
+CLASS_WORD = 0
+CLASS_BLANK = 1
+CLASS_NEWLINE = 2
+CLASS_COMMENT = 3
+CLASS_COMMA = 4
+CLASS_NUMBER = 5
+CLASS_LABEL = 6
+
+CHAR_CLASS = [CLASS_WORD] * 256
+CHAR_CLASS[ord(t.SPACE)] = CLASS_BLANK
+CHAR_CLASS[ord(t.TAB)] = CLASS_BLANK
+CHAR_CLASS[ord(t.NEWLINE)] = CLASS_NEWLINE
+CHAR_CLASS[ord(t.START_COMMENT_LINE)] = CLASS_COMMENT
+CHAR_CLASS[ord(t.COMMA)] = CLASS_COMMA
+CHAR_CLASS[ord(t.PREFIX_NUM)] = CLASS_NUMBER
+CHAR_CLASS[ord(t.START_LABEL)] = CLASS_LABEL
+CHAR_CLASS = tuple(CHAR_CLASS)
+
+DIGITS = frozenset(b"0123456789")
+MINUS = ord("-")
+COLON = ord(t.COLON)
+
+NON_ASCII = re.compile(b"[\x80-\xff]")
+NEWLINE = re.compile(t.NEWLINE.encode())
+LABEL_END = re.compile(("[%s%s]" % (t.SPACE, t.NEWLINE)).encode())
+
+VALID_INSNS = ("movb", "addb", "subb", "mulb", "divb", "prib", "jmp")
+VALID_REGS = ("r0", "r1", "r2", "r3")
+
+KEYWORDS = dict(
+    [(insn, n.MNEMONIC) for insn in VALID_INSNS]
+    + [(reg, n.REGISTER) for reg in VALID_REGS]
+)
+
+# every keyword is uniquely identified by its first two bytes, so a
+# word is resolved by a single lookup followed by a prefix check.
+KEYWORD_PREFIXES = dict(
+    ((ord(k[0]) << 8) | ord(k[1]), (k, k.encode(), len(k), kind))
+    for k, kind in KEYWORDS.items()
+)
+
+# default amount of bytes pulled from the source by a streaming lexer.
+STREAM_CHUNK_SIZE = 1 << 16
+
+
+"""
+Reject non-ASCII input, 'offset' and 'lines' locate the buffer inside
+a larger source and are only used to position the error.
+"""
+
+
+def check_ascii(buffer, offset=0, lines=0):
+    match = NON_ASCII.search(buffer)
+
+    if match is None:
+        return
+
+    position = match.start()
+    head = bytes(buffer[:position])
+
+    raise LexedEntityError(
+        "Non-ASCII character (0x%02x) at offset %d (line: %d, column: %d)."
+        % (
+            buffer[position],
+            offset + position,
+            lines + head.count(b"\n") + 1,
+            position - head.rfind(b"\n"),
+        )
+    )
+
 
 class Lexer(object):
     def __init__(self):
-        self.input = ""
-        self.token = ""
+        self.input = b""
         self.position = 0
-        self.is_negative = False
-        self.token_objects = []
+        self.token_objects = self._create_token_objects()
+        self.flushed = 0
+        self.exhausted = False
+        self.offset = 0
+        self.lines = 0
 
     """
 	"""
 
     def lex(self, buffer):
-        self.input = buffer.decode()
+        self.input = buffer
+        self._check_ascii()
+
+        # a token is only completed once the scanner has moved past
+        # it, so a trailing single character is never emitted.
+        self._scan(len(self.input) - 1)
+
+    """
+    Lex a binary file object (or anything exposing read(), such as
+    an mmap) and lazily yield token objects.
+
+    The source is consumed in chunks of at most 'chunk_size' bytes
+    and only complete lines are scanned, so memory use is bounded by
+    the chunk size plus the longest line, not by the source size.
+    """
 
-        while True:
-            if self._is_eof():
-                self._process_when_eof()
+    def lex_stream(self, stream, chunk_size=STREAM_CHUNK_SIZE):
+        carry = b""
+
+        while not self.exhausted:
+            chunk = stream.read(chunk_size)
+
+            if not chunk:
                 break
 
-            if self.token == t.SPACE or self.token == t.TAB:
-                self.token = ""
-                continue
+            buffer = carry + chunk
+            last = buffer.rfind(b"\n")
 
-            if self.token == t.NEWLINE:
-                self._process_newline()
-                self.token = ""
+            if last <= 0:
+                carry = buffer
                 continue
 
-            if self.token == t.START_COMMENT_LINE:
-                self._process_comment_line()
-                self.token = ""
-                continue
+            # the block keeps its last newline so comments and labels
+            # are terminated, but the newline itself is only scanned
+            # as the head of the next block, since it may turn out to
+            # be the very last character of the input.
+            for token in self._lex_block(buffer[: last + 1]):
+                yield token
 
-            if self.token == t.COMMA:
-                self._process_comma()
-                self.token = ""
-                continue
+            carry = buffer[last:]
+            self.offset += last
+            self.lines += buffer.count(b"\n", 0, last)
 
-            if self.token == t.PREFIX_NUM:
-                self._process_integer()
-                self.token = ""
-                continue
+        if not self.exhausted:
+            for token in self._lex_block(carry):
+                yield token
 
-            if self.token == t.START_LABEL:
-                self._process_label()
-                self.token = ""
-                continue
+    """
+	"""
 
-            if self._is_valid_insn(self.token):
-                self._process_mnemonic()
-                self.token = ""
-                continue
+    def _lex_block(self, block):
+        self.input = block
+        self.position = 0
+        self._check_ascii()
+        self._scan(len(self.input) - 1)
 
-            if self._is_valid_reg(self.token):
-                self._process_register()
-                self.token = ""
-                continue
+        tokens = self.token_objects
+        self.flushed += len(tokens)
+        self.token_objects = self._create_token_objects()
 
-            self.token += self._current()
-            self._next()
+        return tokens
 
     """
 	"""
 
-    def get_token_objects(self):
-        return self.token_objects
+    def _scan(self, end):
+        text = self.input
+        classes = CHAR_CLASS
+        handlers = (
+            self._process_word,
+            self._process_blank,
+            self._process_newline,
+            self._process_comment_line,
+            self._process_comma,
+            self._process_integer,
+            self._process_label,
+        )
+
+        while self.position < end:
+            handlers[classes[text[self.position]]]()
 
     """
 	"""
 
-    def add_node(self, node):
-        self.token_objects.append(node)
+    def _check_ascii(self):
+        check_ascii(self.input, self.offset, self.lines)
 
     """
 	"""
 
-    def _next(self):
-        self.position += 1
+    def get_token_objects(self):
+        return self.token_objects
 
     """
 	"""
 
-    def _prev(self):
-        self.position -= 1
+    def add_node(self, node):
+        self.token_objects.append(node)
 
     """
 	"""
 
-    def _current(self):
-        return self.input[self.position]
+    def _create_token_objects(self):
+        return []
 
     """
 	"""
 
-    def _peek(self):
-        return self.input[self.position + 1]
+    def _emit(self, kind, value, position):
+        self.add_node(node.CLASSES[kind](value))
 
     """
 	"""
 
-    def _is_eof(self):
-        return self.position >= len(self.input)
+    def _process_blank(self):
+        self.position += 1
 
     """
 	"""
 
     def _process_comma(self):
-        self.add_node(node.Comma(self.token))
+        self._emit(n.COMMA, t.COMMA, self.position)
+        self.position += 1
+
+    """
+	"""
+
+    def _process_newline(self):
+        self._emit(n.NEWLINE, t.NEWLINE, self.position)
+        self.position += 1
 
     """
 	"""
 
     def _process_integer(self):
-        try:
-            self.input[self.position]
-        except IndexError as e:
+        text = self.input
+        end = len(text)
+        start = self.position + 1
+
+        if start >= end:
             raise ParodySyntaxError(
                 "Syntax error, '#' must be followed by number "
                 + "(either positive/negative) or +/- sign then followed by number."
             )
 
-        self.token = ""
-        self.is_negative = True if self._current() == "-" else False
+        is_negative = text[start] == MINUS
 
-        if self.is_negative == True:
-            self._next()
+        if is_negative == True:
+            start += 1
 
-        exists = True
+            if start >= end:
+                raise ParodySyntaxError(
+                    "Syntax error, '-' must be followed by decimal digit."
+                )
 
-        try:
-            self.input[self.position]
-        except IndexError as e:
-            exists = False
-
-        if self.is_negative == True and exists == False:
-            raise ParodySyntaxError(
-                "Syntax error, '-' must be followed by decimal digit."
-            )
-
-        while True:
-            try:
-                self.input[self.position]
-            except IndexError as e:
-                break
+        position = start
 
-            if self._current().isnumeric() == False or self._current() == t.COMMA:
-                break
+        while position < end and text[position] in DIGITS:
+            position += 1
 
-            self.token += self._current()
-            self._next()
+        value = int(bytes(text[start:position]))
 
-        self.add_node(
-            node.Number(
-                int(self.token) * -1 if self.is_negative == True else int(self.token)
-            )
+        self._emit(
+            n.NUMBER, value * -1 if is_negative == True else value, self.position
         )
+        self.position = position
 
     """
 	"""
 
     def _process_label(self):
-        exception = False
-
-        while True:
-            if self._is_eof() or self._current() == t.NEWLINE:
-                break
-
-            if self._current() == t.SPACE:
-                exception = True
-                break
+        text = self.input
+        match = LABEL_END.search(text, self.position)
+        position = len(text) if match is None else match.start()
 
-            self.token += self._current()
-            self._next()
-
-        if exception == True:
+        if position < len(text) and text[position] == ord(t.SPACE):
             raise LexedEntityError("Label name cannot contain whitespace characters.")
 
-        if self.token[-1] != ":" and (
-            len(self.token_objects) == 0
-            and self.token_objects[-1].get_type() != n.MNEMONIC
-        ):
+        stop = position - 1 if text[position - 1] == COLON else position
+
+        if stop == position and len(self.token_objects) == 0 and self.flushed == 0:
             raise LexedEntityError("Label name must ended by colon.")
 
-        self.token = self.token[1 : (-1 if self.token[-1] == ":" else len(self.token))]
-        self.add_node(node.Label(self.token))
+        # label names are the only tokens materialized as strings
+        # straight from the input.
+        self._emit(n.LABEL, str(text[self.position + 1 : stop], "ascii"), self.position)
+
+        # the terminating newline (if any) is left for the main loop.
+        self.position = position
 
     """
 	"""
 
-    def _process_mnemonic(self):
-        self.add_node(node.Mnemonic(self.token))
+    def _process_comment_line(self):
+        match = NEWLINE.search(self.input, self.position)
 
-    """
-	"""
+        if match is None:
+            self.position = len(self.input)
+            return
 
-    def _process_newline(self):
-        self.add_node(node.Newline(self.token))
+        position = match.start()
+
+        # the comment itself is terminated by a newline, and the
+        # newline is then scanned again by the main loop.
+        self._emit(n.NEWLINE, t.NEWLINE, position)
+        self.position = position
 
     """
 	"""
 
-    def _process_comment_line(self):
-        while True:
-            if self._is_eof():
-                break
+    def _process_word(self):
+        text = self.input
+        position = self.position
+        keyword = KEYWORD_PREFIXES.get((text[position] << 8) | text[position + 1])
 
-            if self._current() == t.NEWLINE:
-                self.token = self._current()
-                break
+        if keyword is not None:
+            word, raw, length, kind = keyword
 
-            # ignore the current token except newline
-            # because this is in the scope of comment
-            # section.
-            self._next()
+            if text[position : position + length] == raw:
+                self._emit(kind, word, position)
+                self.position += length
+                return
 
-        if self.token == t.NEWLINE:
-            self._process_newline()
+        # a word which is not prefixed by a mnemonic or register name
+        # can never be terminated, so the rest of the input is dropped.
+        self.position = len(text)
+        self.exhausted = True
 
     """
 	"""
 
-    def _process_register(self):
-        self.add_node(node.Register(self.token))
+    def _get_valid_insns(self):
+        return list(VALID_INSNS)
 
     """
 	"""
 
-    def _process_when_eof(self):
-        if self._is_valid_insn(self.token):
-            self._process_mnemonic()
-
-        if self._is_valid_reg(self.token):
-            self._process_register()
+    def _is_valid_insn(self, insn):
+        return KEYWORDS.get(insn) == n.MNEMONIC
 
     """
 	"""
 
-    def _get_valid_insns(self):
-        return ["movb", "addb", "subb", "mulb", "divb", "prib", "jmp"]
+    def _get_valid_regs(self):
+        return list(VALID_REGS)
 
     """
 	"""
 
-    def _is_valid_insn(self, insn):
-        return insn in self._get_valid_insns()
+    def _is_valid_reg(self, reg):
+        return KEYWORDS.get(reg) == n.REGISTER
+
+
+class CompactLexer(Lexer):
+    """
+    Lexer variant which records tokens into a struct-of-arrays
+    token stream instead of allocating one node object per token.
+    """
+
+    def get_token_stream(self):
+        return self.token_objects
 
     """
 	"""
 
-    def _get_valid_regs(self):
-        return ["r0", "r1", "r2", "r3"]
+    def _create_token_objects(self):
+        return ts.TokenStream()
 
     """
 	"""
 
-    def _is_valid_reg(self, reg):
-        return reg in self._get_valid_regs()
+    def _emit(self, kind, value, position):
+        self.token_objects.append(kind, value, self.offset + position)
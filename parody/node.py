@@ -37,6 +37,8 @@ from abc import ABC, abstractmethod
 
 
 class AbstractNode(ABC):
+    __slots__ = ("value", "childs")
+
     def __init__(self, value):
         self.value = value
         self.childs = []
@@ -83,6 +85,8 @@ class AbstractNode(ABC):
 class Comma(AbstractNode):
     """ """
 
+    __slots__ = ()
+
     def get_name(self):
         return "<comma>"
 
@@ -96,6 +100,8 @@ class Comma(AbstractNode):
 class Label(AbstractNode):
     """ """
 
+    __slots__ = ()
+
     def get_name(self):
         return "<label>"
 
@@ -109,6 +115,8 @@ class Label(AbstractNode):
 class Mnemonic(AbstractNode):
     """ """
 
+    __slots__ = ()
+
     def get_name(self):
         return "<mnemonic>"
 
@@ -122,6 +130,8 @@ class Mnemonic(AbstractNode):
 class Newline(AbstractNode):
     """ """
 
+    __slots__ = ()
+
     def get_name(self):
         return "<newline>"
 
@@ -135,6 +145,8 @@ class Newline(AbstractNode):
 class Number(AbstractNode):
     """ """
 
+    __slots__ = ()
+
     def get_name(self):
         return "<number>"
 
@@ -148,6 +160,8 @@ class Number(AbstractNode):
 class Register(AbstractNode):
     """ """
 
+    __slots__ = ()
+
     def get_name(self):
         return "<register>"
 
@@ -156,3 +170,13 @@ class Register(AbstractNode):
 
     def get_type(self):
         return n.REGISTER
+
+
+CLASSES = {
+    n.COMMA: Comma,
+    n.MNEMONIC: Mnemonic,
+    n.NEWLINE: Newline,
+    n.NUMBER: Number,
+    n.REGISTER: Register,
+    n.LABEL: Label,
+}
@@ -0,0 +1,180 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2021, Paulus Gandung Prakosa <gandung@lists.infradead.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Opcode encoder.
+"""
+
+import struct
+
+import parody.opcodes.general as gen
+import parody.opcodes.jump as jgen
+
+# register index, as used by the opcode arithmetic.
+REGISTERS = {"r0": 0, "r1": 1, "r2": 2, "r3": 3}
+
+# the opcode blocks are laid out as base + src + 4 * dst for register to
+# register forms, and base + dst for immediate to register forms.
+REGS_TO_REGS_BASE = {
+    "movb": gen.MOVB_R0_TO_R0,
+    "addb": gen.ADDB_R0_TO_R0,
+    "subb": gen.SUBB_R0_TO_R0,
+    "mulb": gen.MULB_R0_TO_R0,
+    "divb": gen.DIVB_R0_TO_R0,
+}
+IMM8_TO_REGS_BASE = {
+    "movb": gen.MOVB_IMM8_TO_R0,
+    "addb": gen.ADDB_IMM8_TO_R0,
+    "subb": gen.SUBB_IMM8_TO_R0,
+    "mulb": gen.MULB_IMM8_TO_R0,
+    "divb": gen.DIVB_IMM8_TO_R0,
+}
+PRIB_BASE = gen.PRIB_R0
+
+# sign marker followed by the big-endian magnitude.
+IMMEDIATE = struct.Struct(">BI")
+IMMEDIATE_NEGATIVE = 0xFF
+IMMEDIATE_POSITIVE = 0xFE
+
+# compact immediates: values up to IMMEDIATE_INLINE_MAX are the marker
+# byte itself, other ones use the smallest form they fit in, and
+# IMMEDIATE_POOL refers to an entry of the constant pool.
+IMMEDIATE_INLINE_MAX = 0xEF
+IMMEDIATE_BYTE = 0xFA
+IMMEDIATE_WORD = 0xFB
+IMMEDIATE_POOL = 0xFC
+IMMEDIATE_BYTE_FORM = struct.Struct(">Bb")
+IMMEDIATE_WORD_FORM = struct.Struct(">Bh")
+IMMEDIATE_POOL_FORM = struct.Struct(">BH")
+
+# a constant pool section starts with this byte and the entry count,
+# followed by the entries in the 5-byte immediate form. Jump offsets are
+# relative to the code following it.
+CONSTANT_POOL = 0xCF
+CONSTANT_POOL_HEADER = struct.Struct(">BH")
+CONSTANT_POOL_MAX = 0xFFFF
+
+# prefix, jump opcode and big-endian absolute offset.
+JUMP = struct.Struct(">BBI")
+
+# jump encodings, smallest first: opcode, layout, and the displacement
+# range of the relative ones. The displacement is taken from the end of
+# the jump to the first byte after the label.
+JUMP_FORMS = (
+    (jgen.JUMP_SHORT, struct.Struct(">BBb"), -0x80, 0x7F),
+    (jgen.JUMP_NEAR, struct.Struct(">BBh"), -0x8000, 0x7FFF),
+    (jgen.JUMP_PLAIN, JUMP, None, None),
+)
+
+"""
+"""
+
+
+def regs_to_regs(mnemonic, src, dst):
+    return REGS_TO_REGS_BASE[mnemonic] + src + 4 * dst
+
+
+"""
+"""
+
+
+def imm8_to_regs(mnemonic, dst):
+    return IMM8_TO_REGS_BASE[mnemonic] + dst
+
+
+"""
+"""
+
+
+def prib(reg):
+    return PRIB_BASE + reg
+
+
+"""
+Return 'num' as it reads back from its immediate encoding, which only
+keeps 32 bits of magnitude.
+"""
+
+
+def normalize_immediate(num):
+    norm = abs(num) & 0xFFFFFFFF
+
+    return -norm if num < 0 else norm
+
+
+"""
+"""
+
+
+def immediate(num):
+    return IMMEDIATE.pack(
+        IMMEDIATE_NEGATIVE if num < 0 else IMMEDIATE_POSITIVE, abs(num) & 0xFFFFFFFF
+    )
+
+
+"""
+"""
+
+
+def compact_immediate(num):
+    num = normalize_immediate(num)
+
+    if 0 <= num <= IMMEDIATE_INLINE_MAX:
+        return bytes((num,))
+
+    if -0x80 <= num <= 0x7F:
+        return IMMEDIATE_BYTE_FORM.pack(IMMEDIATE_BYTE, num)
+
+    if -0x8000 <= num <= 0x7FFF:
+        return IMMEDIATE_WORD_FORM.pack(IMMEDIATE_WORD, num)
+
+    return immediate(num)
+
+
+"""
+"""
+
+
+def pool_reference(index):
+    return IMMEDIATE_POOL_FORM.pack(IMMEDIATE_POOL, index)
+
+
+"""
+Encode the constant pool section holding 'values'.
+"""
+
+
+def constant_pool(values):
+    section = bytearray(CONSTANT_POOL_HEADER.pack(CONSTANT_POOL, len(values)))
+
+    for num in values:
+        section += immediate(num)
+
+    return bytes(section)
@@ -33,3 +33,5 @@ Jump-related opcode.
 """
 
 JUMP_PLAIN = 0x10
+JUMP_SHORT = 0x11
+JUMP_NEAR = 0x12
@@ -0,0 +1,609 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2021, Paulus Gandung Prakosa <gandung@lists.infradead.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+AST optimization passes, run between Parser and Codegen.
+"""
+
+import parody.ast as ast
+import parody.ast_kind as a
+import parody.exceptions as ex
+import parody.node as node
+import parody.node_kind as n
+from abc import ABC, abstractmethod
+
+BINARY_INSNS = ("movb", "addb", "subb", "mulb", "divb")
+
+# largest magnitude an immediate operand can be encoded with.
+IMMEDIATE_MAX = 0xFFFFFFFF
+
+"""
+Return the mnemonic and operand token nodes of an instruction line
+node, or (None, None) for any other node.
+"""
+
+
+def decode_line(line):
+    if line.get_type() != a.AST_INSTRUCTION_LINE:
+        return None, None
+
+    childs = line.get_childs()
+
+    return (
+        childs[0].get_value().get_value(),
+        [child.get_value() for child in childs[1:]],
+    )
+
+
+"""
+Build an instruction line node out of a mnemonic and operand tokens.
+"""
+
+
+def create_line(mnemonic, operands):
+    line = ast.Ast(a.AST_INSTRUCTION_LINE, None)
+    line.add_child(ast.Ast(a.AST_MNEMONIC, node.Mnemonic(mnemonic)))
+
+    for el in operands:
+        line.add_child(ast.Ast(ast.NODE_TYPES[el.get_type()], el))
+
+    return line
+
+
+"""
+Return the registers read and the registers written by an instruction
+line, as two tuples of names.
+"""
+
+
+def register_effects(mnemonic, operands):
+    reads = tuple([el.get_value() for el in operands if el.get_type() == n.REGISTER])
+
+    if mnemonic not in BINARY_INSNS:
+        return reads, ()
+
+    if mnemonic == "movb":
+        return reads[:-1], reads[-1:]
+
+    return reads, reads[-1:]
+
+
+"""
+Map every label name to the index of its last definition, which is the
+one Codegen uses, and make sure 'childs' is something Codegen accepts.
+"""
+
+
+def find_targets(childs):
+    targets = {}
+
+    for index, child in enumerate(childs):
+        if child.get_type() == a.AST_LABEL:
+            targets[child.get_value().get_value()] = index
+        elif child.get_type() != a.AST_INSTRUCTION_LINE:
+            raise ex.AstError("Current ast node is not instruction or label.")
+
+    for child in childs:
+        mnemonic, operands = decode_line(child)
+
+        if mnemonic != "jmp":
+            continue
+
+        if operands[0].get_type() != n.LABEL:
+            raise ex.AstError(
+                "Jump-related instruction must be followed by label name."
+            )
+
+        if operands[0].get_value() not in targets:
+            raise ex.AstError(
+                "Jump label '%s' is not defined." % (operands[0].get_value())
+            )
+
+    return targets
+
+
+class PeepholeRule(ABC):
+    """
+    A peephole rule looks at a window of at most 'window' root childs,
+    the first one being an instruction line, and either returns None
+    or a (count, replacement) pair: the first 'count' childs of the
+    window are replaced by the 'replacement' list of nodes.
+    """
+
+    name = None
+    window = 1
+
+    @abstractmethod
+    def rewrite(self, childs):
+        pass
+
+
+class SelfMoveRule(PeepholeRule):
+    """
+    Remove "movb rX, rX".
+    """
+
+    name = "self-move"
+
+    def rewrite(self, childs):
+        mnemonic, operands = decode_line(childs[0])
+
+        if (
+            mnemonic == "movb"
+            and operands[0].get_type() == n.REGISTER
+            and operands[0].get_value() == operands[1].get_value()
+        ):
+            return 1, []
+
+
+class CombineImmediateRule(PeepholeRule):
+    """
+    Fold adjacent "addb #a, rX" / "subb #b, rX" into a single one, or
+    into nothing when they cancel out.
+    """
+
+    name = "combine-immediate"
+    window = 2
+
+    def rewrite(self, childs):
+        if len(childs) < 2:
+            return None
+
+        first = self._decode_immediate(childs[0])
+        second = self._decode_immediate(childs[1])
+
+        if first is None or second is None or first[1] != second[1]:
+            return None
+
+        total = first[2] + second[2]
+
+        if total == 0:
+            return 2, []
+
+        if abs(total) > IMMEDIATE_MAX:
+            return None
+
+        # keep the mnemonic of the first line.
+        if first[0] == "subb":
+            total = -total
+
+        value = node.Number(total)
+        register = node.Register(first[1])
+
+        return 2, [create_line(first[0], [value, register])]
+
+    """
+    Return (mnemonic, register, signed addend) of an immediate add or
+    sub, or None.
+    """
+
+    def _decode_immediate(self, line):
+        mnemonic, operands = decode_line(line)
+
+        if mnemonic != "addb" and mnemonic != "subb":
+            return None
+
+        if operands[0].get_type() != n.NUMBER:
+            return None
+
+        value = operands[0].get_value()
+
+        if abs(value) > IMMEDIATE_MAX:
+            return None
+
+        return (
+            mnemonic,
+            operands[1].get_value(),
+            value if mnemonic == "addb" else -value,
+        )
+
+
+class DeadStoreRule(PeepholeRule):
+    """
+    Remove a "movb" whose destination is overwritten by a later "movb"
+    of the same basic block before it is read. The scan stops at a
+    "divb", which may fail while the store is still visible.
+    """
+
+    name = "dead-store"
+    window = 16
+
+    def rewrite(self, childs):
+        mnemonic, operands = decode_line(childs[0])
+
+        if mnemonic != "movb":
+            return None
+
+        target = operands[1].get_value()
+
+        for child in childs[1:]:
+            mnemonic, operands = decode_line(child)
+
+            # a label may be jumped to, a jmp leaves the block.
+            if mnemonic is None or mnemonic == "jmp" or mnemonic == "divb":
+                return None
+
+            reads, writes = register_effects(mnemonic, operands)
+
+            if target in reads:
+                return None
+
+            if target in writes:
+                return 1, []
+
+        return None
+
+
+BUILTIN_RULES = (SelfMoveRule, CombineImmediateRule, DeadStoreRule)
+
+
+class PeepholeOptimizer(object):
+    """
+    Rewrite the root childs of an AST with a set of peephole rules
+    until none of them applies. Every rewrite shrinks the program, and
+    after one the scan steps back the widest rule window but one, so
+    that every window overlapping the rewrite is matched again.
+    """
+
+    def __init__(self, rules=None):
+        if rules is None:
+            rules = [rule() for rule in BUILTIN_RULES]
+
+        self.rules = list(rules)
+        self.hits = dict([(rule.name, 0) for rule in self.rules])
+
+    """
+	"""
+
+    def add_rule(self, rule):
+        self.rules.append(rule)
+        self.hits.setdefault(rule.name, 0)
+
+    """
+	"""
+
+    def get_rules(self):
+        return self.rules
+
+    """
+	"""
+
+    def get_hits(self):
+        return self.hits
+
+    """
+    Return a new root holding the optimized childs of 'tree', which is
+    left untouched.
+    """
+
+    def optimize(self, tree):
+        if tree.get_type() != a.AST_ROOT:
+            raise ex.AstError("Current ast type is not root.")
+
+        width = max([rule.window for rule in self.rules] + [1])
+        pending = list(reversed(tree.get_childs()))
+        done = []
+
+        while len(pending) != 0:
+            if pending[-1].get_type() != a.AST_INSTRUCTION_LINE:
+                done.append(pending.pop())
+                continue
+
+            window = pending[: -width - 1 : -1]
+            result = None
+
+            for rule in self.rules:
+                result = rule.rewrite(window[: rule.window])
+
+                if result is not None:
+                    break
+
+            if result is None:
+                done.append(pending.pop())
+                continue
+
+            self.hits[rule.name] += 1
+
+            count, replacement = result
+            del pending[-count:]
+            pending.extend(reversed(replacement))
+
+            for _ in range(min(width - 1, len(done))):
+                pending.append(done.pop())
+
+        root = ast.Ast(a.AST_ROOT, None)
+        root.set_childs(done)
+
+        return root
+
+
+class DeadCodeEliminator(object):
+    """
+    Split the root childs into basic blocks, which start at labels and
+    after jmp lines, and keep only the blocks reachable from the first
+    one. A jmp goes to the last definition of its label, like it does
+    in Codegen; labels that no remaining jmp goes to are dropped too.
+    """
+
+    def __init__(self):
+        self.stats = {"blocks": 0, "lines": 0, "labels": 0}
+
+    """
+	"""
+
+    def get_stats(self):
+        return self.stats
+
+    """
+    Return a new root holding the reachable childs of 'tree', which is
+    left untouched.
+    """
+
+    def optimize(self, tree):
+        if tree.get_type() != a.AST_ROOT:
+            raise ex.AstError("Current ast type is not root.")
+
+        childs = tree.get_childs()
+        targets = find_targets(childs)
+        starts = self._find_leaders(childs)
+        ends = starts[1:] + [len(childs)]
+        reachable = self._find_reachable(childs, starts, ends, targets)
+
+        kept = []
+        used = set()
+
+        for block in sorted(reachable):
+            kept += range(starts[block], ends[block])
+
+        for index in kept:
+            mnemonic, operands = decode_line(childs[index])
+
+            if mnemonic == "jmp":
+                used.add(operands[0].get_value())
+
+        root = ast.Ast(a.AST_ROOT, None)
+
+        for index in kept:
+            child = childs[index]
+
+            if child.get_type() == a.AST_LABEL:
+                name = child.get_value().get_value()
+
+                # only the last definition of a label is ever used.
+                if name not in used or targets[name] != index:
+                    continue
+
+            root.add_child(child)
+
+        for key, ast_type in (
+            ("lines", a.AST_INSTRUCTION_LINE),
+            ("labels", a.AST_LABEL),
+        ):
+            self.stats[key] += self._count(childs, ast_type) - self._count(
+                root.get_childs(), ast_type
+            )
+
+        self.stats["blocks"] += len(starts) - len(reachable)
+
+        return root
+
+    """
+    Return the index of the first child of every basic block.
+    """
+
+    def _find_leaders(self, childs):
+        starts = []
+
+        for index, child in enumerate(childs):
+            if (
+                index == 0
+                or child.get_type() == a.AST_LABEL
+                or decode_line(childs[index - 1])[0] == "jmp"
+            ):
+                starts.append(index)
+
+        return starts
+
+    """
+	"""
+
+    def _find_reachable(self, childs, starts, ends, targets):
+        block_at = dict([(start, block) for block, start in enumerate(starts)])
+        reachable = set()
+        pending = [0] if len(starts) != 0 else []
+
+        while len(pending) != 0:
+            block = pending.pop()
+
+            if block in reachable:
+                continue
+
+            reachable.add(block)
+            mnemonic, operands = decode_line(childs[ends[block] - 1])
+
+            if mnemonic == "jmp":
+                pending.append(block_at[targets[operands[0].get_value()]])
+            elif block + 1 < len(starts):
+                pending.append(block + 1)
+
+        return reachable
+
+    """
+	"""
+
+    def _count(self, childs, ast_type):
+        return len([child for child in childs if child.get_type() == ast_type])
+
+
+class JumpThreader(object):
+    """
+    Retarget every jmp whose label is directly followed by another jmp
+    to the end of that chain, then drop the jmp lines only followed by
+    labels up to their own target, as they would fall through anyway.
+
+    A chain coming back to one of its labels is a jump-only cycle, it
+    never runs an instruction again. Such jumps are left alone and
+    reported by get_cycles(), or rejected if 'strict' is set.
+    """
+
+    def __init__(self, strict=False):
+        self.strict = strict
+        self.stats = {"threaded": 0, "removed": 0}
+        self.cycles = []
+
+    """
+	"""
+
+    def get_stats(self):
+        return self.stats
+
+    """
+	"""
+
+    def get_cycles(self):
+        return self.cycles
+
+    """
+    Return a new root holding the rewritten childs of 'tree', which is
+    left untouched.
+    """
+
+    def optimize(self, tree):
+        if tree.get_type() != a.AST_ROOT:
+            raise ex.AstError("Current ast type is not root.")
+
+        childs = tree.get_childs()
+        targets = find_targets(childs)
+        finals = {}
+        threaded = []
+
+        for child in childs:
+            mnemonic, operands = decode_line(child)
+
+            if mnemonic == "jmp":
+                name = operands[0].get_value()
+                final = self._follow(childs, targets, finals, name)
+
+                if final is not None and final != name:
+                    child = create_line("jmp", [node.Label(final)])
+                    self.stats["threaded"] += 1
+
+            threaded.append(child)
+
+        # walk backwards, so a jmp only skipping over dropped jmp lines
+        # is dropped as well.
+        kept = []
+
+        for index in range(len(threaded) - 1, -1, -1):
+            child = threaded[index]
+            mnemonic, operands = decode_line(child)
+
+            if mnemonic == "jmp" and self._falls_through(
+                kept, targets[operands[0].get_value()]
+            ):
+                self.stats["removed"] += 1
+                continue
+
+            kept.append((index, child))
+
+        root = ast.Ast(a.AST_ROOT, None)
+        root.set_childs([child for index, child in reversed(kept)])
+
+        return root
+
+    """
+    Return the label at the end of the jmp chain starting at 'name', or
+    None when the chain is a cycle.
+    """
+
+    def _follow(self, childs, targets, finals, name):
+        if name in finals:
+            return finals[name]
+
+        chain = []
+        final = name
+
+        while final is not None:
+            if final in chain:
+                self._report_cycle(chain[chain.index(final) :])
+                final = None
+                break
+
+            if final in finals:
+                final = finals[final]
+                break
+
+            chain.append(final)
+            index = targets[final] + 1
+
+            while index < len(childs) and childs[index].get_type() == a.AST_LABEL:
+                index += 1
+
+            if index == len(childs):
+                break
+
+            mnemonic, operands = decode_line(childs[index])
+
+            if mnemonic != "jmp":
+                break
+
+            final = operands[0].get_value()
+
+        for el in chain:
+            finals[el] = final
+
+        return final
+
+    """
+	"""
+
+    def _report_cycle(self, chain):
+        if self.strict == True:
+            raise ex.AstError(
+                "Jump-only cycle through labels '%s'." % ("', '".join(chain))
+            )
+
+        self.cycles.append(chain)
+
+    """
+    'kept' holds the (index, child) pairs kept after a jmp, nearest
+    last. The jmp falls through when its target label comes before any
+    kept instruction line.
+    """
+
+    def _falls_through(self, kept, target):
+        for index, child in reversed(kept):
+            if index == target:
+                return True
+
+            if index > target or child.get_type() != a.AST_LABEL:
+                return False
+
+        return False
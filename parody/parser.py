@@ -32,11 +32,37 @@
 Parser objects, method, and related-operations.
 """
 
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
 import parody.ast as ast
+import parody.ast_arena as ast_arena
 import parody.ast_kind as a
 import parody.exceptions as ex
+import parody.lexer as lexer
 import parody.node_kind as n
 
+# inputs smaller than this are not worth shipping to worker processes.
+PARALLEL_MIN_SIZE = 1 << 20
+
+# allowed operand kinds (commas included) of every mnemonic.
+BINARY_OPERANDS = frozenset(
+    [(n.REGISTER, n.COMMA, n.REGISTER), (n.NUMBER, n.COMMA, n.REGISTER)]
+)
+UNARY_OPERANDS = frozenset([(n.REGISTER,), (n.NUMBER,)])
+JUMP_OPERANDS = frozenset([(n.LABEL,)])
+
+SIGNATURES = {
+    "movb": BINARY_OPERANDS,
+    "addb": BINARY_OPERANDS,
+    "subb": BINARY_OPERANDS,
+    "mulb": BINARY_OPERANDS,
+    "divb": BINARY_OPERANDS,
+    "prib": UNARY_OPERANDS,
+    "jmp": JUMP_OPERANDS,
+}
+
 
 class Parser(object):
     def __init__(self, lexer):
@@ -70,6 +96,116 @@ class Parser(object):
 
             self._next()
 
+    """
+    Lex and parse 'buffer' in worker processes.
+
+    The input is split into one chunk per worker on newline boundaries,
+    each chunk is parsed into an AstArena by a fresh parser, with a
+    lexer of the same type as this one, and sent back as flat columns.
+    The columns are spliced, in order, into this parser's arena, or
+    turned into Ast nodes for a plain Parser. The resulting tree, line
+    counter and error, if any, are the same as the ones of parse().
+    """
+
+    def parse_parallel(self, buffer, workers=None, min_size=PARALLEL_MIN_SIZE):
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        if workers <= 1 or len(buffer) < min_size:
+            return self.parse(buffer)
+
+        lexer.check_ascii(buffer)
+
+        chunks = self._split_chunks(buffer, workers)
+        kinds = (type(self), type(self.lexer))
+
+        results = []
+        failures = []
+        line = self.line
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            futures = [pool.submit(_parse_chunk, kinds, chunk) for chunk in chunks]
+
+            for chunk, future in zip(chunks, futures):
+                try:
+                    result = future.result()
+                except Exception:
+                    # parse the failing chunk again with the right line
+                    # offset, so the error message is the sequential one.
+                    parser = _create_chunk_parser(kinds, line)
+
+                    try:
+                        parser.parse(chunk)
+                        columns, count, exhausted = _get_chunk_result(parser)
+                        result = (columns, count - line, exhausted)
+                    except Exception as e:
+                        lexing = parser.get_input() is None
+                        exhausted = parser.get_lexer().exhausted
+                        failures.append((lexing, e))
+                        result = None
+
+                if result is not None:
+                    results.append(result)
+                    exhausted = result[2]
+                    line += result[1]
+
+                # an unterminated word swallows the rest of the input.
+                if exhausted == True:
+                    for pending in futures:
+                        pending.cancel()
+
+                    break
+
+        # parse() lexes the whole input before parsing it, so a lexing
+        # error is raised before a parse error found in an earlier chunk.
+        for lexing, error in failures:
+            if lexing == True:
+                raise error
+
+        for lexing, error in failures:
+            raise error
+
+        for columns, count, exhausted in results:
+            self._add_columns(columns)
+            self.line += count
+
+    """
+    Parse a binary file object (or an mmap) lazily, yielding every
+    AST_LABEL and AST_INSTRUCTION_LINE node as soon as it is complete.
+
+    Tokens are pulled from Lexer.lex_stream() and the nodes are not
+    added to the root, so memory use does not grow with the program
+    size. Unlike parse(), which lexes the whole input first, a lexing
+    error is only raised once the parser has reached it.
+    """
+
+    def parse_stream(self, stream, chunk_size=lexer.STREAM_CHUNK_SIZE):
+        tmp = None
+
+        for token in self.lexer.lex_stream(stream, chunk_size):
+            kind = token.get_type()
+
+            if tmp is not None and kind != n.NEWLINE:
+                tmp.append(token)
+                continue
+
+            if tmp is not None:
+                self.line += 1
+                child = self._create_instruction_line(tmp)
+                tmp = None
+
+                yield child
+                continue
+
+            if kind == n.LABEL:
+                yield self._create_label(token)
+
+            if kind == n.MNEMONIC:
+                tmp = [token]
+
+        if tmp is not None:
+            yield self._create_instruction_line(tmp)
+
     """
 	"""
 
@@ -109,6 +245,38 @@ class Parser(object):
     """
 	"""
 
+    def _split_chunks(self, buffer, count):
+        size = len(buffer)
+        starts = [0]
+
+        for index in range(1, count):
+            position = buffer.find(b"\n", max(index * size // count, starts[-1] + 1))
+
+            # a boundary newline must be followed by at least one byte,
+            # otherwise it is the trailing character of the input.
+            if position == -1 or position >= size - 1:
+                break
+
+            starts.append(position)
+
+        # every chunk but the last also carries the newline ending it
+        # plus one more byte, so that newline is scanned like it is in
+        # the whole input. The next chunk starts at the same newline,
+        # which only yields a leading newline token and is ignored.
+        ends = [start + 2 for start in starts[1:]] + [size]
+
+        return [bytes(buffer[start:end]) for start, end in zip(starts, ends)]
+
+    """
+	"""
+
+    def _add_columns(self, columns):
+        for child in ast_arena.build_childs(columns):
+            self.ast.add_child(child)
+
+    """
+	"""
+
     def _current(self):
         return self.input[self.position]
 
@@ -134,7 +302,7 @@ class Parser(object):
 	"""
 
     def _process_label(self):
-        self.ast.add_child(ast.Ast(a.AST_LABEL, self._current()))
+        self.ast.add_child(self._create_label(self._current()))
 
     """
 	"""
@@ -156,10 +324,25 @@ class Parser(object):
         if len(tmp) == 0:
             return
 
-        if tmp[0].get_type() != n.MNEMONIC:
-            raise SyntaxError("Instruction line must be prefixed by valid mnemonic.")
+        self._add_instruction_line(tmp)
 
-        self._run_instruction_line_validator(tmp)
+    """
+	"""
+
+    def _add_instruction_line(self, tmp):
+        self.ast.add_child(self._create_instruction_line(tmp))
+
+    """
+	"""
+
+    def _create_label(self, token):
+        return ast.Ast(a.AST_LABEL, token)
+
+    """
+	"""
+
+    def _create_instruction_line(self, tmp):
+        self._check_instruction_line(tmp)
 
         child = ast.Ast(a.AST_INSTRUCTION_LINE, None)
 
@@ -169,138 +352,140 @@ class Parser(object):
 
             child.add_child(ast.Ast(self._determine_node_type(el), el))
 
-        self.ast.add_child(child)
+        return child
 
     """
 	"""
 
-    def _validate_binary_movb_instruction(self, insn):
-        if insn[0].get_value() == "movb" and insn[3].get_type() == n.NUMBER:
-            raise SyntaxError(
-                "Number cannot be placed in second operand when it's mnemonic "
-                + " is 'movb' (line: %d)." % (self.line)
-            )
-
-        if insn[0].get_value() == "movb" and (
-            (insn[1].get_type() != n.REGISTER or insn[1].get_type() != n.NUMBER)
-            and insn[3].get_type() != n.REGISTER
-        ):
-            raise SyntaxError(
-                "First operand must be register or numeric constant, and second operand "
-                + "must be register (line: %d)." % (self.line)
-            )
+    def _check_instruction_line(self, tmp):
+        if tmp[0].get_type() != n.MNEMONIC:
+            raise SyntaxError("Instruction line must be prefixed by valid mnemonic.")
+
+        self._run_instruction_line_validator(tmp)
 
     """
 	"""
 
-    def _validate_binary_addb_instruction(self, insn):
-        if insn[0].get_value() == "addb" and insn[3].get_type() == n.NUMBER:
-            raise SyntaxError(
-                "Number cannot be placed in second operand when it's mnemonic is "
-                + "'addb' (line: %d)." % (self.line)
-            )
-
-        if insn[0].get_value() == "addb" and (
-            (insn[1].get_type() != n.REGISTER or insn[1].get_type() != n.NUMBER)
-            and insn[3].get_type() != n.REGISTER
-        ):
-            raise SyntaxError(
-                "First operand must be register or numeric constant, and second operand "
-                + "must be register (line: %d)." % (self.line)
-            )
+    def _run_instruction_line_validator(self, insn):
+        validate_instruction(
+            insn[0].get_value(),
+            tuple([el.get_type() for el in insn[1:]]),
+            self.line,
+        )
 
     """
 	"""
 
-    def _validate_binary_subb_instruction(self, insn):
-        if insn[0].get_value() == "subb" and insn[3].get_type() == n.NUMBER:
-            raise SyntaxError(
-                "Number cannot be placed in second operand when it's mnemonic is "
-                + "'subb' (line: %d)." % (self.line)
-            )
-
-        if insn[0].get_value() == "subb" and (
-            (insn[1].get_type() != n.REGISTER or insn[1].get_type() != n.NUMBER)
-            and insn[3].get_type() != n.REGISTER
-        ):
-            raise SyntaxError(
-                "First operand must be register or numeric constant, and second operand "
-                + "must be register (line: %d)." % (self.line)
-            )
+    def _determine_node_type(self, val):
+        return ast.NODE_TYPES.get(val.get_type())
+
 
+class CompactParser(Parser):
+    """
+    A parser building its tree into an AstArena instead of Ast objects.
     """
-	"""
 
-    def _validate_binary_mulb_instruction(self, insn):
-        if insn[0].get_value() == "mulb" and insn[3].get_type() == n.NUMBER:
-            raise SyntaxError(
-                "Number cannot be placed in second operand when it's mnemonic is "
-                + "'mulb' (line: %d)." % (self.line)
-            )
-
-        if insn[0].get_value() == "mulb" and (
-            (insn[1].get_type() != n.REGISTER or insn[1].get_type() != n.NUMBER)
-            and insn[3].get_type() != n.REGISTER
-        ):
-            raise SyntaxError(
-                "First operand must be register or numeric constant, and second operand "
-                + "must be register (line: %d)." % (self.line)
-            )
+    def __init__(self, lexer):
+        super(CompactParser, self).__init__(lexer)
+        self.ast = ast_arena.AstArena()
 
     """
 	"""
 
-    def _validate_binary_divb_instruction(self, insn):
-        if insn[0].get_value() == "divb" and insn[3].get_type() == n.NUMBER:
-            raise SyntaxError(
-                "Number cannot be placed in second operand when it's mnemonic is "
-                + "'mulb' (line: %d)." % (self.line)
-            )
-
-        if insn[0].get_value() == "divb" and (
-            (insn[1].get_type() != n.REGISTER or insn[1].get_type() != n.NUMBER)
-            and insn[3].get_type() != n.REGISTER
-        ):
-            raise SyntaxError(
-                "First operand must be register or numeric constant, and second operand "
-                + "must be register (line: %d)." % (self.line)
-            )
+    def _process_label(self):
+        self.ast.add_label(self._current())
 
     """
 	"""
 
-    def _validate_binary_prib_instruction(self, insn):
-        if insn[0].get_value() == "prib" and (
-            insn[1].get_type() != n.NUMBER and insn[1].get_type() != n.REGISTER
-        ):
-            raise SyntaxError(
-                "'prib' instruction must be followed by register name or number."
-            )
+    def _add_instruction_line(self, tmp):
+        self._check_instruction_line(tmp)
+        self.ast.add_instruction_line(tmp)
 
     """
 	"""
 
-    def _run_instruction_line_validator(self, insn):
-        ilen = len(insn)
-
-        if ilen == 2:
-            self._validate_binary_prib_instruction(insn)
-        elif ilen == 4:
-            self._validate_binary_movb_instruction(insn)
-            self._validate_binary_addb_instruction(insn)
-            self._validate_binary_subb_instruction(insn)
-            self._validate_binary_mulb_instruction(insn)
-            self._validate_binary_divb_instruction(insn)
-        else:
-            raise SyntaxError("Unknown instruction.")
+    def _add_columns(self, columns):
+        self.ast.add_columns(columns)
 
-    """
-	"""
 
-    def _determine_node_type(self, val):
-        if val.get_type() == n.MNEMONIC:
-            return a.AST_MNEMONIC
-        elif val.get_type() == n.REGISTER:
-            return a.AST_REGISTER
-        elif val.get_type() == n.NUMBER:
-            return a.AST_INTEGER_VALUE
+"""
+Check the operand kinds (commas included) of an instruction line
+against the signature table, 'line' is only used in error messages.
+"""
+
+
+def validate_instruction(mnemonic, signature, line):
+    signatures = SIGNATURES[mnemonic]
+
+    if signature in signatures:
+        return
+
+    if len(signature) != len(next(iter(signatures))):
+        raise SyntaxError("Unknown instruction.")
+
+    if signatures is UNARY_OPERANDS:
+        raise SyntaxError(
+            "'%s' instruction must be followed by register name or number." % (mnemonic)
+        )
+
+    if signatures is JUMP_OPERANDS:
+        raise SyntaxError(
+            "'%s' instruction must be followed by label name (line: %d)."
+            % (mnemonic, line)
+        )
+
+    if signature[2] == n.NUMBER:
+        raise SyntaxError(
+            "Number cannot be placed in second operand when it's mnemonic is "
+            + "'%s' (line: %d)." % (mnemonic, line)
+        )
+
+    raise SyntaxError(
+        "First operand must be register or numeric constant, and second operand "
+        + "must be register (line: %d)." % (line)
+    )
+
+
+"""
+Worker entry point of Parser.parse_parallel().
+"""
+
+
+def _parse_chunk(kinds, chunk, line=0):
+    parser = _create_chunk_parser(kinds, line)
+    parser.parse(chunk)
+
+    return _get_chunk_result(parser)
+
+
+"""
+Return a parser for a chunk, with a lexer of the given type and its
+line counter set to 'line'.
+"""
+
+
+def _create_chunk_parser(kinds, line):
+    parser_type, lexer_type = kinds
+
+    if issubclass(parser_type, CompactParser) == False:
+        parser_type = CompactParser
+
+    parser = parser_type(lexer_type())
+    parser.line = line
+
+    return parser
+
+
+"""
+Return the arena columns, line count and lexer exhaustion of a parsed
+chunk.
+"""
+
+
+def _get_chunk_result(parser):
+    return (
+        parser.get_ast().get_columns(),
+        parser.line,
+        parser.get_lexer().exhausted,
+    )
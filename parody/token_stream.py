@@ -0,0 +1,130 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2021, Paulus Gandung Prakosa <gandung@lists.infradead.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compact token stream representation.
+"""
+
+from array import array
+
+import parody.node as node
+import parody.node_kind as n
+
+from parody.exceptions import LexedEntityError
+
+
+class TokenStream(object):
+    """
+    Tokens stored as parallel columns: kind code, interned operand id,
+    integer value (numbers only) and source offset.
+
+    Indexing the stream yields the interned node object of a token, so
+    every distinct comma, mnemonic, register, number and label is only
+    allocated once no matter how many times it occurs.
+    """
+
+    def __init__(self):
+        self.kinds = array("B")
+        self.operands = array("L")
+        self.values = array("q")
+        self.offsets = array("Q")
+        self.symbols = []
+        self.symbol_ids = {}
+
+    """
+	"""
+
+    def append(self, kind, value, offset):
+        key = (kind, value)
+        operand = self.symbol_ids.get(key)
+
+        if operand is None:
+            operand = len(self.symbols)
+            self.symbol_ids[key] = operand
+            self.symbols.append(node.CLASSES[kind](value))
+
+        try:
+            self.values.append(value if kind == n.NUMBER else 0)
+        except OverflowError as e:
+            raise LexedEntityError(
+                "Number %d does not fit in 64 bits (offset: %d)." % (value, offset)
+            )
+
+        self.kinds.append(kind)
+        self.operands.append(operand)
+        self.offsets.append(offset)
+
+    """
+	"""
+
+    def get_kind(self, index):
+        return self.kinds[index]
+
+    """
+	"""
+
+    def get_value(self, index):
+        return self.symbols[self.operands[index]].get_value()
+
+    """
+	"""
+
+    def get_offset(self, index):
+        return self.offsets[index]
+
+    """
+	"""
+
+    def get_symbols(self):
+        return self.symbols
+
+    """
+	"""
+
+    def __len__(self):
+        return len(self.kinds)
+
+    """
+	"""
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.symbols[operand] for operand in self.operands[index]]
+
+        return self.symbols[self.operands[index]]
+
+    """
+	"""
+
+    def __iter__(self):
+        symbols = self.symbols
+
+        for operand in self.operands:
+            yield symbols[operand]
@@ -0,0 +1,1033 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2021, Paulus Gandung Prakosa <gandung@lists.infradead.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Bytecode virtual machine.
+"""
+
+import collections
+import struct
+import sys
+import time
+
+from functools import partial
+
+import parody.assembler as assembler
+import parody.exceptions as ex
+import parody.opcodes.encoding as enc
+import parody.opcodes.general as gen
+import parody.opcodes.jump as jgen
+
+# instructions per second the dispatch loop should sustain on the
+# benchmark() loop.
+THROUGHPUT_TARGET = 1500000
+
+# the benchmark() loop body, and how many instructions it runs.
+BENCHMARK_BODY = (
+    b"movb #7, r0\naddb r0, r1\nsubb #3, r1\nmulb r1, r2\nmovb r2, r3\n"
+    b"addb #1, r3\ndivb #3, r2\n"
+)
+BENCHMARK_STEPS = 1000000
+
+REGISTER_COUNT = 4
+REGISTER_MASK = 0xFF
+
+OFFSET = struct.Struct(">I")
+SIGNED_BYTE = struct.Struct(">b")
+SIGNED_WORD = struct.Struct(">h")
+UNSIGNED_WORD = struct.Struct(">H")
+
+# pairs seen fewer times than this in a histogram are not fused.
+HISTOGRAM_MIN_COUNT = 64
+
+"""
+Run 'code' and return the virtual machine it ran on.
+"""
+
+
+def run(code, out=None, max_steps=None, machine_type=None):
+    if machine_type is None:
+        machine_type = VirtualMachine
+
+    vm = machine_type(code, out)
+    vm.run(max_steps)
+
+    return vm
+
+
+"""
+Run BENCHMARK_STEPS instructions of an endless straight-line loop on a
+'machine_type' machine, and return its stats along with the target and
+whether its throughput met it.
+"""
+
+
+def benchmark(machine_type=None, max_steps=BENCHMARK_STEPS):
+    code = assembler.assemble(b"@loop:\n" + BENCHMARK_BODY * 16 + b"jmp @loop\n")
+    stats = run(code, None, max_steps, machine_type).get_stats()
+    stats["target"] = THROUGHPUT_TARGET
+    stats["met"] = stats["ips"] >= THROUGHPUT_TARGET
+
+    return stats
+
+
+class VirtualMachine(object):
+    """
+    Executes the bytecode produced by Codegen (in any of its modes) or
+    by the assembler. Registers hold bytes, arithmetic wraps around,
+    divb is unsigned, and prib writes the value in decimal, one per
+    line. Execution stops when the instruction pointer leaves the code.
+
+    The main loop fetches the opcode byte and calls its entry of a
+    256-entry handler table; each handler returns the next instruction
+    pointer. Register handlers decode the inline and 5-byte immediates
+    themselves, the other forms go through _read_immediate().
+    """
+
+    def __init__(self, code, out=None):
+        self.out = sys.stdout if out is None else out
+        self.registers = [0] * REGISTER_COUNT
+        self.pool = []
+        self.code = self._load(bytes(code))
+        self.ip = 0
+        self.steps = 0
+        self.elapsed = 0.0
+        self.handlers = self._create_handlers()
+
+    """
+	"""
+
+    def get_registers(self):
+        return self.registers
+
+    """
+	"""
+
+    def get_ip(self):
+        return self.ip
+
+    """
+	"""
+
+    def get_code(self):
+        return self.code
+
+    """
+	"""
+
+    def get_pool(self):
+        return self.pool
+
+    """
+    Executed instruction count, time spent in run() and the resulting
+    instructions per second.
+    """
+
+    def get_stats(self):
+        return {
+            "instructions": self.steps,
+            "seconds": self.elapsed,
+            "ips": self.steps / self.elapsed if self.elapsed > 0 else 0.0,
+        }
+
+    """
+    Run until the instruction pointer leaves the code, or for at most
+    'max_steps' instructions. Return True once the program has ended.
+    """
+
+    def run(self, max_steps=None):
+        code = self.code
+        handlers = self.handlers
+        ip = self.ip
+        end = len(code)
+        steps = 0
+        limit = -1 if max_steps is None else max_steps
+        started = time.perf_counter()
+
+        try:
+            while ip < end and steps != limit:
+                ip = handlers[code[ip]](ip)
+                steps += 1
+        finally:
+            self.elapsed += time.perf_counter() - started
+            self.steps += steps
+            self.ip = ip
+
+        return ip >= end
+
+    """
+	"""
+
+    def _load(self, code):
+        if len(code) == 0 or code[0] != enc.CONSTANT_POOL:
+            return code
+
+        count = UNSIGNED_WORD.unpack_from(code, 1)[0]
+        position = enc.CONSTANT_POOL_HEADER.size
+
+        for _ in range(count):
+            value, position = self._read_immediate(code, position)
+            self.pool.append(value)
+
+        return code[position:]
+
+    """
+    Decode the immediate starting at 'position', in any of the plain and
+    compact forms, returning it with the position following it.
+    """
+
+    def _read_immediate(self, code, position):
+        marker = code[position]
+
+        if marker <= enc.IMMEDIATE_INLINE_MAX:
+            return marker, position + 1
+
+        if marker == enc.IMMEDIATE_POSITIVE:
+            return OFFSET.unpack_from(code, position + 1)[0], position + 5
+
+        if marker == enc.IMMEDIATE_NEGATIVE:
+            return -OFFSET.unpack_from(code, position + 1)[0], position + 5
+
+        if marker == enc.IMMEDIATE_BYTE:
+            return SIGNED_BYTE.unpack_from(code, position + 1)[0], position + 2
+
+        if marker == enc.IMMEDIATE_WORD:
+            return SIGNED_WORD.unpack_from(code, position + 1)[0], position + 3
+
+        if marker == enc.IMMEDIATE_POOL:
+            index = UNSIGNED_WORD.unpack_from(code, position + 1)[0]
+            return self.pool[index], position + 3
+
+        raise ex.RuntimeError(
+            "Invalid immediate marker (0x%02x) at offset %d." % (marker, position)
+        )
+
+    """
+	"""
+
+    def _create_handlers(self):
+        handlers = [self._process_invalid] * 256
+
+        for mnemonic, base in enc.REGS_TO_REGS_BASE.items():
+            operation = OPERATIONS[mnemonic]
+
+            for src in range(REGISTER_COUNT):
+                for dst in range(REGISTER_COUNT):
+                    handlers[base + src + 4 * dst] = self._create_regs_to_regs(
+                        operation, src, dst
+                    )
+
+        for mnemonic, base in enc.IMM8_TO_REGS_BASE.items():
+            operation = OPERATIONS[mnemonic]
+
+            for dst in range(REGISTER_COUNT):
+                handlers[base + dst] = self._create_imm8_to_regs(operation, dst)
+
+        for reg in range(REGISTER_COUNT):
+            handlers[enc.PRIB_BASE + reg] = self._create_prib(reg)
+
+        handlers[gen.PRIB_IMM8] = self._process_prib_imm8
+        handlers[gen.JUMP_REX_PREFIX] = self._process_jump
+
+        return handlers
+
+    """
+	"""
+
+    def _create_regs_to_regs(self, operation, src, dst):
+        registers = self.registers
+
+        def handler(ip):
+            registers[dst] = operation(registers[dst], registers[src], ip)
+            return ip + 1
+
+        return handler
+
+    """
+	"""
+
+    def _create_imm8_to_regs(self, operation, dst):
+        registers = self.registers
+        code = self.code
+        read_immediate = self._read_immediate
+        last = len(code) - 6
+
+        def handler(ip):
+            marker = code[ip + 1]
+
+            # only the low byte of a 5-byte positive immediate is kept.
+            if marker == enc.IMMEDIATE_POSITIVE and ip <= last:
+                registers[dst] = operation(registers[dst], code[ip + 5], ip)
+                return ip + 6
+
+            if marker <= enc.IMMEDIATE_INLINE_MAX:
+                registers[dst] = operation(registers[dst], marker, ip)
+                return ip + 2
+
+            value, next_ip = read_immediate(code, ip + 1)
+            registers[dst] = operation(registers[dst], value & REGISTER_MASK, ip)
+            return next_ip
+
+        return handler
+
+    """
+	"""
+
+    def _create_prib(self, reg):
+        registers = self.registers
+        write = self.out.write
+
+        def handler(ip):
+            write("%d\n" % (registers[reg]))
+            return ip + 1
+
+        return handler
+
+    """
+	"""
+
+    def _process_prib_imm8(self, ip):
+        value, next_ip = self._read_immediate(self.code, ip + 1)
+        self.out.write("%d\n" % (value & REGISTER_MASK))
+
+        return next_ip
+
+    """
+	"""
+
+    def _process_jump(self, ip):
+        code = self.code
+        kind = code[ip + 1]
+
+        if kind == jgen.JUMP_PLAIN:
+            # the offset is the one of the byte preceding the target.
+            return (OFFSET.unpack_from(code, ip + 2)[0] + 1) & 0xFFFFFFFF
+
+        if kind == jgen.JUMP_SHORT:
+            target = ip + 3 + SIGNED_BYTE.unpack_from(code, ip + 2)[0]
+        elif kind == jgen.JUMP_NEAR:
+            target = ip + 4 + SIGNED_WORD.unpack_from(code, ip + 2)[0]
+        else:
+            raise ex.RuntimeError(
+                "Invalid jump kind (0x%02x) at offset %d." % (kind, ip + 1)
+            )
+
+        if target < 0:
+            raise ex.RuntimeError("Jump target out of code at offset %d." % (ip))
+
+        return target
+
+    """
+	"""
+
+    def _process_invalid(self, ip):
+        raise ex.RuntimeError(
+            "Invalid opcode (0x%02x) at offset %d." % (self.code[ip], ip)
+        )
+
+
+"""
+Register operations, taking the destination and source values and the
+offset of the instruction (for error messages).
+"""
+
+
+def _movb(dst, src, ip):
+    return src
+
+
+def _addb(dst, src, ip):
+    return (dst + src) & REGISTER_MASK
+
+
+def _subb(dst, src, ip):
+    return (dst - src) & REGISTER_MASK
+
+
+def _mulb(dst, src, ip):
+    return (dst * src) & REGISTER_MASK
+
+
+def _divb(dst, src, ip):
+    if src == 0:
+        raise ex.RuntimeError("Division by zero at offset %d." % (ip))
+
+    return dst // src
+
+
+OPERATIONS = {
+    "movb": _movb,
+    "addb": _addb,
+    "subb": _subb,
+    "mulb": _mulb,
+    "divb": _divb,
+}
+
+
+class ThreadedMachine(VirtualMachine):
+    """
+    Runs the code pre-decoded into a list of (handler, operand) pairs:
+    immediates are decoded to ints and jump targets translated to
+    instruction indices once, at load time, so a step is a single call
+    with no decoding. The observable behaviour is the one of the
+    byte-level machine, except that a jump into the middle of an
+    instruction raises instead of running the bytes found there.
+
+    Unless 'superinstructions' is False, adjacent pairs listed in
+    SUPERINSTRUCTIONS, and the ones of 'histogram' (see pair_histogram())
+    seen at least HISTOGRAM_MIN_COUNT times, are fused into a single
+    handler compiled from their STATEMENTS, provided no jump lands on
+    the second instruction. A fused pair counts as two steps, and is
+    run as its first instruction alone when a single step is left.
+    """
+
+    def __init__(self, code, out=None, superinstructions=True, histogram=None):
+        super(ThreadedMachine, self).__init__(code, out)
+        self.pc = 0
+        self.offsets = []
+        self.program = self._predecode()
+        self.histogram = collections.Counter()
+        self.fused = 0
+
+        # the entries replaced by superinstructions, by index, how many
+        # times a superinstruction got past its first instruction, and
+        # the index of the second instruction when it raised.
+        self.originals = {}
+        self.pairs = [0, None]
+
+        if superinstructions == True:
+            self._fuse(histogram or {})
+
+        # every step is a call of a partial already bound to its index
+        # and operand, the extra last one stops the loop.
+        self.calls = [
+            partial(handler, pc, operand)
+            for pc, (handler, operand) in enumerate(self.program)
+        ]
+        self.calls.append(self._thread_halt)
+
+    """
+	"""
+
+    def get_ip(self):
+        if self.pc < len(self.offsets):
+            return self.offsets[self.pc]
+
+        return len(self.code)
+
+    """
+	"""
+
+    def get_program(self):
+        return self.program
+
+    """
+	"""
+
+    def get_stats(self):
+        stats = super(ThreadedMachine, self).get_stats()
+        stats["superinstructions"] = self.fused
+
+        return stats
+
+    """
+    Return the form of the instruction at index 'pc' (see FORMS), or
+    None for the ones that cannot be part of a superinstruction.
+    """
+
+    def get_form(self, pc):
+        handler = self.program[pc][0]
+
+        if handler == self._thread_bad_jump or handler == self._thread_invalid:
+            return None
+
+        return FORMS[self.code[self.offsets[pc]]]
+
+    """
+	"""
+
+    def get_histogram(self):
+        return self.histogram
+
+    """
+    Run like run(), counting in the histogram how many times each pair
+    of form names was executed in sequence. Return the histogram.
+    """
+
+    def profile(self, max_steps=None):
+        program = self.program
+        originals = self.originals
+        end = len(program)
+        histogram = self.histogram
+        pc = self.pc
+        steps = 0
+        limit = -1 if max_steps is None else max_steps
+        started = time.perf_counter()
+
+        try:
+            while pc < end and steps != limit:
+                handler, operand = originals.get(pc, program[pc])
+                next_pc = handler(pc, operand)
+                steps += 1
+
+                if next_pc == pc + 1 and next_pc < end:
+                    first = self.get_form(pc)
+                    second = self.get_form(next_pc)
+
+                    if first is not None and second is not None:
+                        histogram[(first[0], second[0])] += 1
+
+                pc = next_pc
+        finally:
+            self.elapsed += time.perf_counter() - started
+            self.steps += steps
+            self.pc = pc
+
+        return histogram
+
+    """
+	"""
+
+    def run(self, max_steps=None):
+        calls = self.calls
+        program = self.program
+        pairs = self.pairs
+        end = len(program)
+        pc = self.pc
+        steps = 0
+        limit = sys.maxsize if max_steps is None else max_steps
+        started = time.perf_counter()
+
+        try:
+            while pc < end and steps < limit:
+                # a call takes at most two steps, so this many calls
+                # cannot go past the limit.
+                rounds = (limit - steps) // 2
+
+                if rounds == 0:
+                    handler, operand = self.originals.get(pc, program[pc])
+                    pc = handler(pc, operand)
+                    steps += 1
+                    continue
+
+                done = 0
+                counted = pairs[0]
+
+                try:
+                    for done in range(rounds):
+                        pc = calls[pc]()
+                    else:
+                        done = rounds
+                finally:
+                    steps += done + pairs[0] - counted
+        except _Halted:
+            pass
+        except ex.RuntimeError:
+            if pairs[1] is not None:
+                pc = pairs[1]
+                pairs[1] = None
+
+            raise
+        finally:
+            self.elapsed += time.perf_counter() - started
+            self.steps += steps
+            self.pc = pc
+
+        return pc >= end
+
+    """
+	"""
+
+    def _predecode(self):
+        code = self.code
+        decoders = self._create_decoders()
+        program = []
+        jumps = []
+        position = 0
+
+        while position < len(code):
+            self.offsets.append(position)
+            handler, operand, position = decoders[code[position]](position)
+
+            if handler == self._thread_jump:
+                jumps.append(len(program))
+
+            program.append((handler, operand))
+
+            # the length of an unknown opcode is unknown as well.
+            if handler == self._thread_invalid:
+                break
+
+        indices = dict([(offset, index) for index, offset in enumerate(self.offsets)])
+
+        for index in jumps:
+            target = program[index][1]
+
+            if target >= len(code):
+                program[index] = (self._thread_jump, len(program))
+            elif target in indices:
+                program[index] = (self._thread_jump, indices[target])
+            else:
+                program[index] = (self._thread_bad_jump, target)
+
+        return program
+
+    """
+    Replace the first instruction of each fusable pair by a
+    superinstruction returning the index following the pair. The second
+    one keeps its entry, so indices and offsets do not change.
+    """
+
+    def _fuse(self, histogram):
+        program = self.program
+        targets = set(
+            [operand for handler, operand in program if handler == self._thread_jump]
+        )
+        pc = 0
+
+        while pc + 1 < len(program):
+            first = self.get_form(pc)
+            second = self.get_form(pc + 1)
+
+            if first is None or second is None or pc + 1 in targets:
+                pc += 1
+                continue
+
+            pair = (first[0], second[0])
+
+            if first[0] == "jump" or (
+                pair not in SUPERINSTRUCTIONS
+                and histogram.get(pair, 0) < HISTOGRAM_MIN_COUNT
+            ):
+                pc += 1
+                continue
+
+            handler = _create_superinstruction(
+                self, first, program[pc][1], second, program[pc + 1][1]
+            )
+            self.originals[pc] = program[pc]
+            program[pc] = (handler, None)
+            self.fused += 1
+            pc += 2
+
+    """
+    Return the 256-entry table of decoders, each one taking the offset
+    of an instruction and returning (handler, operand, next offset).
+    """
+
+    def _create_decoders(self):
+        decoders = [self._decode_invalid] * 256
+
+        for mnemonic, base in enc.REGS_TO_REGS_BASE.items():
+            for src in range(REGISTER_COUNT):
+                for dst in range(REGISTER_COUNT):
+                    decoders[base + src + 4 * dst] = self._create_plain_decoder(
+                        THREADED_REGS_TO_REGS[mnemonic](self, src, dst)
+                    )
+
+        for mnemonic, base in enc.IMM8_TO_REGS_BASE.items():
+            for dst in range(REGISTER_COUNT):
+                decoders[base + dst] = self._create_immediate_decoder(
+                    THREADED_IMM8_TO_REGS[mnemonic](self, dst)
+                )
+
+        for reg in range(REGISTER_COUNT):
+            decoders[enc.PRIB_BASE + reg] = self._create_plain_decoder(
+                _threaded_prib(self, reg)
+            )
+
+        decoders[gen.PRIB_IMM8] = self._create_immediate_decoder(self._thread_prib_imm8)
+        decoders[gen.JUMP_REX_PREFIX] = self._decode_jump
+
+        return decoders
+
+    """
+	"""
+
+    def _create_plain_decoder(self, handler):
+        def decoder(position):
+            return handler, None, position + 1
+
+        return decoder
+
+    """
+	"""
+
+    def _create_immediate_decoder(self, handler):
+        code = self.code
+        read_immediate = self._read_immediate
+
+        def decoder(position):
+            value, next_position = read_immediate(code, position + 1)
+            return handler, value & REGISTER_MASK, next_position
+
+        return decoder
+
+    """
+    Decode a jump, its operand is the byte offset of the target until
+    _predecode() translates it.
+    """
+
+    def _decode_jump(self, position):
+        code = self.code
+        kind = code[position + 1]
+
+        if kind == jgen.JUMP_PLAIN:
+            target = (OFFSET.unpack_from(code, position + 2)[0] + 1) & 0xFFFFFFFF
+            return self._thread_jump, target, position + 6
+
+        if kind == jgen.JUMP_SHORT:
+            target = position + 3 + SIGNED_BYTE.unpack_from(code, position + 2)[0]
+            return self._thread_jump, target, position + 3
+
+        if kind == jgen.JUMP_NEAR:
+            target = position + 4 + SIGNED_WORD.unpack_from(code, position + 2)[0]
+            return self._thread_jump, target, position + 4
+
+        return self._thread_invalid, None, position
+
+    """
+	"""
+
+    def _decode_invalid(self, position):
+        return self._thread_invalid, None, position
+
+    """
+	"""
+
+    def _thread_prib_imm8(self, pc, operand):
+        self.out.write("%d\n" % (operand))
+        return pc + 1
+
+    """
+	"""
+
+    def _thread_halt(self):
+        raise _Halted()
+
+    """
+	"""
+
+    def _thread_jump(self, pc, operand):
+        return operand
+
+    """
+	"""
+
+    def _thread_bad_jump(self, pc, operand):
+        if operand < 0:
+            raise ex.RuntimeError(
+                "Jump target out of code at offset %d." % (self.offsets[pc])
+            )
+
+        raise ex.RuntimeError(
+            "Jump into the middle of an instruction (offset: %d) at offset %d."
+            % (operand, self.offsets[pc])
+        )
+
+    """
+	"""
+
+    def _thread_invalid(self, pc, operand):
+        return self._process_invalid(self.offsets[pc])
+
+
+class _Halted(Exception):
+    pass
+
+
+"""
+Collect the opcode-pair histogram of 'code' by running it for at most
+'max_steps' instructions, to be passed to ThreadedMachine.
+"""
+
+
+def pair_histogram(code, out=None, max_steps=None):
+    vm = ThreadedMachine(code, out, superinstructions=False)
+
+    try:
+        vm.profile(max_steps)
+    except ex.RuntimeError:
+        pass
+
+    return vm.get_histogram()
+
+
+"""
+Threaded handler factories, one per mnemonic so the arithmetic is
+inlined in the handler.
+"""
+
+
+def _threaded_prib(vm, reg):
+    registers = vm.registers
+    write = vm.out.write
+
+    def handler(pc, operand):
+        write("%d\n" % (registers[reg]))
+        return pc + 1
+
+    return handler
+
+
+def _threaded_movb_regs(vm, src, dst):
+    registers = vm.registers
+
+    def handler(pc, operand):
+        registers[dst] = registers[src]
+        return pc + 1
+
+    return handler
+
+
+def _threaded_addb_regs(vm, src, dst):
+    registers = vm.registers
+
+    def handler(pc, operand):
+        registers[dst] = (registers[dst] + registers[src]) & REGISTER_MASK
+        return pc + 1
+
+    return handler
+
+
+def _threaded_subb_regs(vm, src, dst):
+    registers = vm.registers
+
+    def handler(pc, operand):
+        registers[dst] = (registers[dst] - registers[src]) & REGISTER_MASK
+        return pc + 1
+
+    return handler
+
+
+def _threaded_mulb_regs(vm, src, dst):
+    registers = vm.registers
+
+    def handler(pc, operand):
+        registers[dst] = (registers[dst] * registers[src]) & REGISTER_MASK
+        return pc + 1
+
+    return handler
+
+
+def _threaded_divb_regs(vm, src, dst):
+    registers = vm.registers
+
+    def handler(pc, operand):
+        registers[dst] = _divb(registers[dst], registers[src], vm.offsets[pc])
+        return pc + 1
+
+    return handler
+
+
+def _threaded_movb_imm8(vm, dst):
+    registers = vm.registers
+
+    def handler(pc, operand):
+        registers[dst] = operand
+        return pc + 1
+
+    return handler
+
+
+def _threaded_addb_imm8(vm, dst):
+    registers = vm.registers
+
+    def handler(pc, operand):
+        registers[dst] = (registers[dst] + operand) & REGISTER_MASK
+        return pc + 1
+
+    return handler
+
+
+def _threaded_subb_imm8(vm, dst):
+    registers = vm.registers
+
+    def handler(pc, operand):
+        registers[dst] = (registers[dst] - operand) & REGISTER_MASK
+        return pc + 1
+
+    return handler
+
+
+def _threaded_mulb_imm8(vm, dst):
+    registers = vm.registers
+
+    def handler(pc, operand):
+        registers[dst] = (registers[dst] * operand) & REGISTER_MASK
+        return pc + 1
+
+    return handler
+
+
+def _threaded_divb_imm8(vm, dst):
+    registers = vm.registers
+
+    def handler(pc, operand):
+        registers[dst] = _divb(registers[dst], operand, vm.offsets[pc])
+        return pc + 1
+
+    return handler
+
+
+THREADED_REGS_TO_REGS = {
+    "movb": _threaded_movb_regs,
+    "addb": _threaded_addb_regs,
+    "subb": _threaded_subb_regs,
+    "mulb": _threaded_mulb_regs,
+    "divb": _threaded_divb_regs,
+}
+THREADED_IMM8_TO_REGS = {
+    "movb": _threaded_movb_imm8,
+    "addb": _threaded_addb_imm8,
+    "subb": _threaded_subb_imm8,
+    "mulb": _threaded_mulb_imm8,
+    "divb": _threaded_divb_imm8,
+}
+
+
+"""
+Build the form table: the form name and fields (register operands) of
+each opcode, or None for the ones not starting an instruction.
+"""
+
+
+def _create_forms():
+    forms = [None] * 256
+
+    for mnemonic, base in enc.REGS_TO_REGS_BASE.items():
+        for src in range(REGISTER_COUNT):
+            for dst in range(REGISTER_COUNT):
+                forms[base + src + 4 * dst] = (
+                    mnemonic + "_regs",
+                    (("src", src), ("dst", dst)),
+                )
+
+    for mnemonic, base in enc.IMM8_TO_REGS_BASE.items():
+        for dst in range(REGISTER_COUNT):
+            forms[base + dst] = (mnemonic + "_imm8", (("dst", dst),))
+
+    for reg in range(REGISTER_COUNT):
+        forms[enc.PRIB_BASE + reg] = ("prib_reg", (("reg", reg),))
+
+    forms[gen.PRIB_IMM8] = ("prib_imm8", ())
+    forms[gen.JUMP_REX_PREFIX] = ("jump", ())
+
+    return forms
+
+
+FORMS = _create_forms()
+
+# Python statement of each form, given its fields, the name of its
+# operand and of its instruction index. Jumps have none, they are only
+# fused as the second instruction of a pair, which then returns the
+# target.
+STATEMENTS = {
+    "movb_regs": "registers[{dst}] = registers[{src}]",
+    "addb_regs": "registers[{dst}] = (registers[{dst}] + registers[{src}]) & 0xFF",
+    "subb_regs": "registers[{dst}] = (registers[{dst}] - registers[{src}]) & 0xFF",
+    "mulb_regs": "registers[{dst}] = (registers[{dst}] * registers[{src}]) & 0xFF",
+    "divb_regs": (
+        "registers[{dst}] = _divb(registers[{dst}], registers[{src}], offsets[{pc}])"
+    ),
+    "movb_imm8": "registers[{dst}] = {operand}",
+    "addb_imm8": "registers[{dst}] = (registers[{dst}] + {operand}) & 0xFF",
+    "subb_imm8": "registers[{dst}] = (registers[{dst}] - {operand}) & 0xFF",
+    "mulb_imm8": "registers[{dst}] = (registers[{dst}] * {operand}) & 0xFF",
+    "divb_imm8": "registers[{dst}] = _divb(registers[{dst}], {operand}, offsets[{pc}])",
+    "prib_reg": 'write("%d\\n" % (registers[{reg}]))',
+    "prib_imm8": 'write("%d\\n" % ({operand}))',
+}
+
+# pairs of form names always fused.
+SUPERINSTRUCTIONS = (
+    ("movb_imm8", "addb_regs"),
+    ("movb_imm8", "subb_regs"),
+    ("movb_imm8", "prib_reg"),
+    ("addb_imm8", "prib_reg"),
+    ("addb_imm8", "jump"),
+    ("subb_imm8", "jump"),
+)
+
+# superinstruction factories, by forms.
+_superinstructions = {}
+
+"""
+Return the handler of the superinstruction made of the forms 'first'
+and 'second', with the operands 'first_operand' and 'second_operand'.
+"""
+
+
+def _create_superinstruction(vm, first, first_operand, second, second_operand):
+    key = (first, second)
+    factory = _superinstructions.get(key)
+
+    if factory is None:
+        lines = [
+            "def create(registers, write, offsets, pairs, first, second):",
+            "    def handler(pc, operand):",
+            "        "
+            + STATEMENTS[first[0]].format(operand="first", pc="pc", **dict(first[1])),
+            "        pairs[0] += 1",
+        ]
+
+        if second[0] == "jump":
+            lines.append("        return second")
+        else:
+            lines.append("        try:")
+            lines.append(
+                "            "
+                + STATEMENTS[second[0]].format(
+                    operand="second", pc="pc + 1", **dict(second[1])
+                )
+            )
+            lines.append("        except ex.RuntimeError:")
+            lines.append("            pairs[1] = pc + 1")
+            lines.append("            raise")
+            lines.append("        return pc + 2")
+
+        lines.append("    return handler")
+
+        namespace = {"_divb": _divb, "ex": ex}
+        source = "\n".join(lines) + "\n"
+        name = "<superinstruction %s+%s>" % (first[0], second[0])
+        exec(compile(source, name, "exec"), namespace)
+
+        factory = namespace["create"]
+        _superinstructions[key] = factory
+
+    return factory(
+        vm.registers,
+        vm.out.write,
+        vm.offsets,
+        vm.pairs,
+        first_operand,
+        second_operand,
+    )